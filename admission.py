@@ -0,0 +1,135 @@
+import asyncio
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+
+
+class Overloaded(Exception):
+    """
+    服务器过载，工具调用未被接纳。reason为queue_full（等待队列已满）或timeout（排队超时）。
+    """
+
+    def __init__(self, message, reason):
+        super().__init__(message)
+        self.reason = reason
+
+class AdmissionController:
+    """
+    工具调用的准入控制。
+
+    同时执行的调用数不超过max_in_flight，超出的调用进入有界的等待队列，排队超过queue_timeout秒或
+    队列已满时立即以Overloaded拒绝，而不是让所有请求一起变慢直到超时。
+    等待的调用按客户端分组，空出名额时在各客户端之间轮流分配，单个客户端的突发请求不会占满队列前部。
+    一次调用可以按其实际的并发量占用多个名额（weight，不超过max_in_flight），如批量获取多个网页的调用。
+    max_in_flight不大于0时不限制。
+    """
+
+    def __init__(self, max_in_flight=32, max_queue=128, queue_timeout=10):
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.in_flight = 0
+        self.queued = 0
+        self.admitted = 0
+        self._waiting = OrderedDict()
+
+    @property
+    def clients_waiting(self):
+        return len(self._waiting)
+
+    def stats(self):
+        return {
+            "max_in_flight": self.max_in_flight,
+            "max_queue": self.max_queue,
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "clients_waiting": self.clients_waiting,
+            "admitted": self.admitted,
+        }
+
+    def weight_of(self, weight):
+        if self.max_in_flight <= 0:
+            return max(1, weight)
+        return max(1, min(weight, self.max_in_flight))
+
+    @asynccontextmanager
+    async def slot(self, client, weight=1):
+        """
+        取得weight个执行名额，退出时归还。
+
+        返回：
+            float: 排队等待的时间（秒）
+        """
+        weight = self.weight_of(weight)
+        wait_time = await self.acquire(client, weight)
+        try:
+            yield wait_time
+        finally:
+            self.release(weight)
+
+    async def acquire(self, client, weight=1):
+        if self.max_in_flight <= 0 or (self.in_flight + weight <= self.max_in_flight and not self._waiting):
+            self._admit(weight)
+            return 0.0
+        if self.queued >= self.max_queue:
+            raise Overloaded(
+                f"Server overloaded: {self.in_flight} tool calls running and {self.queued} waiting, "
+                "try again later", "queue_full")
+
+        start_time = time.perf_counter()
+        future = asyncio.get_running_loop().create_future()
+        self._waiting.setdefault(client, deque()).append((future, weight))
+        self.queued += 1
+        try:
+            await asyncio.wait_for(future, self.queue_timeout)
+        except BaseException as err:
+            if future.done() and not future.cancelled():
+                # 名额已分配，但等待方在恢复执行前被取消
+                self.release(weight)
+            else:
+                self._remove_waiter(client, future, weight)
+            if isinstance(err, asyncio.TimeoutError):
+                raise Overloaded(
+                    f"Server overloaded: waited {self.queue_timeout} seconds for one of "
+                    f"{self.max_in_flight} tool call slots, try again later", "timeout")
+            raise
+        return time.perf_counter() - start_time
+
+    def release(self, weight=1):
+        self.in_flight -= weight
+        self._grant_next()
+
+    def _admit(self, weight=1):
+        self.in_flight += weight
+        self.admitted += 1
+
+    def _remove_waiter(self, client, future, weight):
+        waiters = self._waiting.get(client)
+        if waiters is None or (future, weight) not in waiters:
+            return
+        waiters.remove((future, weight))
+        self.queued -= 1
+        if not waiters:
+            del self._waiting[client]
+
+    def _grant_next(self):
+        """
+        在等待的客户端之间轮流分配空出的名额。
+
+        轮到的调用需要的名额多于空闲名额时停止分配，等待更多名额归还，避免占用多个名额的调用一直得不到执行。
+        """
+        while self.in_flight < self.max_in_flight and self._waiting:
+            client, waiters = next(iter(self._waiting.items()))
+            future, weight = waiters[0]
+            if not future.done() and self.in_flight + weight > self.max_in_flight:
+                break
+            waiters.popleft()
+            self.queued -= 1
+            if waiters:
+                self._waiting.move_to_end(client)
+            else:
+                del self._waiting[client]
+            if future.done():
+                continue
+            self._admit(weight)
+            future.set_result(None)
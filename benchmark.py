@@ -0,0 +1,451 @@
+import argparse
+import asyncio
+import json
+import os
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+import uvicorn
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route
+
+# 离线端到端性能测试：本地静态网站 + 模拟的大模型服务 + server.py + client.py，不访问外部网络
+base_dir = os.path.dirname(os.path.abspath(__file__))
+baseline_file = os.path.join(base_dir, "benchmark_baseline.json")
+model_type = "openai"
+concurrency_levels = "1,4,16"
+queries_per_level = 40
+cold_runs = 5
+pages_per_query = 2
+llm_latency = 0.05
+tolerance = 0.2
+run_timeout = 600
+
+# 测试网站的页面：(文件名, 段落数)，覆盖小、中、大三种页面
+fixture_pages = [("small.html", 20), ("medium.html", 200), ("large.html", 2000)]
+
+# 从client.py和server.py的日志中提取各环节的耗时（秒）
+client_stage_patterns = {
+    "startup": re.compile(r"Client ready after (\d+\.\d+) seconds"),
+    "discovery": re.compile(r"Available tools from .+? \((\d+\.\d+) seconds\)"),
+    "session_setup": re.compile(r"Session of service .+ initialized in (\d+\.\d+) seconds"),
+    "tool_call": re.compile(r"Tool \S+ executed in (\d+\.\d+) seconds"),
+    "llm_turn": re.compile(r"Model turn finished in (\d+\.\d+) seconds"),
+    "first_token": re.compile(r"Time to first token: (\d+\.\d+) seconds"),
+}
+server_stage_patterns = {
+    "extraction": re.compile(r"Extracted \S+ in (\d+\.\d+) seconds"),
+}
+batch_pattern = re.compile(r"Batch finished: (\d+) queries \((\d+) failed\) in (\d+\.\d+) seconds")
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def wait_for_port(port, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=1):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise TimeoutError(f"Port {port} not ready after {timeout} seconds")
+
+def build_fixture_site(directory):
+    """
+    生成测试网站的静态页面，页面内容固定，保证每次测试的输入一致。
+    """
+    for name, paragraphs in fixture_pages:
+        body = []
+        for i in range(paragraphs):
+            if i % 10 == 0:
+                body.append(f"<h2>Section {i // 10 + 1}</h2>")
+            body.append(
+                f"<p>Paragraph {i} of {name}. The quick brown fox jumps over the lazy dog, "
+                f"see <a href=\"/page/{i}\">related page {i}</a> for more details. "
+                "快速的棕色狐狸跳过了懒狗。</p>")
+        html = (
+            "<!DOCTYPE html><html><head><meta charset=\"utf-8\"><title>Fixture " + name + "</title></head><body>"
+            "<nav><a href=\"/\">Home</a> | <a href=\"/about\">About</a></nav>"
+            "<article><h1>Fixture " + name + "</h1>" + "".join(body) + "</article>"
+            "<footer>Copyright fixture site</footer></body></html>")
+        with open(os.path.join(directory, name), "w", encoding="utf-8") as f:
+            f.write(html)
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+def start_fixture_site(directory, port):
+    httpd = ThreadingHTTPServer(("127.0.0.1", port), partial(QuietHandler, directory=directory))
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    return httpd
+
+def create_fake_llm(site_url, pages, latency):
+    """
+    创建模拟的大模型服务，兼容OpenAI和Ollama的chat接口（流式和非流式）。
+
+    最后一条消息来自用户时，返回pages个fetch工具调用（依次轮换测试网站的页面）；
+    收到工具结果后返回最终回答。每次响应前等待latency秒模拟推理耗时。
+    """
+    counter = {"requests": 0}
+
+    def script(body):
+        if body["messages"][-1]["role"] != "user":
+            return None
+        urls = []
+        for _ in range(pages):
+            name = fixture_pages[counter["requests"] % len(fixture_pages)][0]
+            counter["requests"] += 1
+            urls.append(f"{site_url}/{name}")
+        return urls
+
+    answer = ["Based", " on", " the", " fetched", " pages", ",", " here", " is", " the", " answer", "."]
+
+    async def openai_chat(request):
+        body = await request.json()
+        urls = script(body)
+        await asyncio.sleep(latency)
+        tool_calls = [{"id": f"call_{i}", "type": "function",
+                       "function": {"name": "fetch", "arguments": json.dumps({"url": url})}}
+                      for i, url in enumerate(urls or [])]
+        if not body.get("stream"):
+            message = {"role": "assistant", "content": None if urls else "".join(answer)}
+            if tool_calls:
+                message["tool_calls"] = tool_calls
+            return JSONResponse({"id": "bench", "object": "chat.completion", "created": 0, "model": body["model"],
+                                 "choices": [{"index": 0, "message": message,
+                                              "finish_reason": "tool_calls" if urls else "stop"}]})
+
+        def chunk(delta, finish_reason=None):
+            return "data: " + json.dumps({
+                "id": "bench", "object": "chat.completion.chunk", "created": 0, "model": body["model"],
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]}) + "\n\n"
+
+        async def generate():
+            if tool_calls:
+                for i, tool_call in enumerate(tool_calls):
+                    arguments = tool_call["function"]["arguments"]
+                    yield chunk({"tool_calls": [{"index": i, "id": tool_call["id"], "type": "function",
+                                                 "function": {"name": "fetch", "arguments": ""}}]})
+                    for k in range(0, len(arguments), 16):
+                        yield chunk({"tool_calls": [{"index": i, "function": {"arguments": arguments[k:k + 16]}}]})
+                yield chunk({}, "tool_calls")
+            else:
+                for word in answer:
+                    yield chunk({"content": word})
+                yield chunk({}, "stop")
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(generate(), media_type="text/event-stream")
+
+    async def ollama_chat(request):
+        body = await request.json()
+        urls = script(body)
+        await asyncio.sleep(latency)
+        base = {"model": body["model"], "created_at": "2025-01-01T00:00:00Z"}
+        tool_calls = [{"function": {"name": "fetch", "arguments": {"url": url}}} for url in urls or []]
+        if not body.get("stream", True):
+            message = {"role": "assistant", "content": "" if urls else "".join(answer)}
+            if tool_calls:
+                message["tool_calls"] = tool_calls
+            return JSONResponse({**base, "message": message, "done": True})
+
+        async def generate():
+            for tool_call in tool_calls:
+                yield json.dumps({**base, "message": {"role": "assistant", "content": "", "tool_calls": [tool_call]},
+                                  "done": False}) + "\n"
+            if not tool_calls:
+                for word in answer:
+                    yield json.dumps({**base, "message": {"role": "assistant", "content": word}, "done": False}) + "\n"
+            yield json.dumps({**base, "message": {"role": "assistant", "content": ""}, "done": True}) + "\n"
+
+        return StreamingResponse(generate(), media_type="application/x-ndjson")
+
+    async def openai_models(request):
+        return JSONResponse({"object": "list", "data": [{"id": "bench", "object": "model", "created": 0,
+                                                         "owned_by": "bench"}]})
+
+    async def ollama_generate(request):
+        # 预热时以空提示加载模型
+        body = await request.json()
+        await asyncio.sleep(latency)
+        return JSONResponse({"model": body["model"], "created_at": "2025-01-01T00:00:00Z", "response": "",
+                             "done": True})
+
+    return Starlette(routes=[
+        Route("/v1/chat/completions", openai_chat, methods=["POST"]),
+        Route("/v1/models", openai_models, methods=["GET"]),
+        Route("/api/chat", ollama_chat, methods=["POST"]),
+        Route("/api/generate", ollama_generate, methods=["POST"]),
+    ])
+
+def start_fake_llm(app, port):
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    wait_for_port(port)
+    return server
+
+def start_mcp_server(port, log_path, fetch_cache, transport="sse"):
+    env = os.environ.copy()
+    env.update({"MCP_SERVER_PORT": str(port), "FETCH_CACHE": "1" if fetch_cache else "0", "PYTHONUNBUFFERED": "1"})
+    log = open(log_path, "w", encoding="utf-8")
+    process = subprocess.Popen([sys.executable, os.path.join(base_dir, "server.py"), "--transport", transport],
+                               cwd=base_dir, env=env, stdout=log, stderr=subprocess.STDOUT)
+    try:
+        wait_for_port(port)
+    except TimeoutError:
+        process.kill()
+        raise
+    return process, log
+
+def percentile(values, p):
+    """
+    按线性插值计算百分位数。
+    """
+    values = sorted(values)
+    if not values:
+        return None
+    k = (len(values) - 1) * p / 100
+    lower = int(k)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (k - lower)
+
+def summarize(samples):
+    return {
+        "count": len(samples),
+        "p50": percentile(samples, 50),
+        "p95": percentile(samples, 95),
+        "p99": percentile(samples, 99),
+    }
+
+def parse_samples(text, patterns):
+    return {stage: [float(value) for value in pattern.findall(text)] for stage, pattern in patterns.items()}
+
+def read_new_log(log_path, offset):
+    with open(log_path, "r", encoding="utf-8", errors="replace") as f:
+        f.seek(offset)
+        text = f.read()
+        return text, f.tell()
+
+def run_client(args, workdir, model_url, config_file, queries, concurrency):
+    """
+    以批量模式运行一次client.py，返回(客户端日志, 结果记录列表, 进程总耗时)。
+    """
+    input_file = os.path.join(workdir, "queries.jsonl")
+    output_file = os.path.join(workdir, "results.jsonl")
+    with open(input_file, "w", encoding="utf-8") as f:
+        for i in range(queries):
+            f.write(json.dumps({"id": f"q{i}", "query": f"Summarize the fixture pages ({i})"}) + "\n")
+    command = [
+        sys.executable, os.path.join(base_dir, "client.py"),
+        "-t", args.model_type, "-n", "bench", "-l", model_url, "-c", config_file,
+        "--tools-cache", "", "--watch-config", "0",
+        "-b", input_file, "-o", output_file, "--batch-concurrency", str(concurrency),
+    ]
+    if args.stream:
+        command.append("--stream")
+    if args.warm_up:
+        command.append("--warm-up")
+    env = os.environ.copy()
+    env.setdefault("OPENAI_API_KEY", "bench")
+    start_time = time.time()
+    completed = subprocess.run(command, cwd=workdir, env=env, stdout=subprocess.DEVNULL,
+                               stderr=subprocess.PIPE, text=True, timeout=run_timeout)
+    elapsed = time.time() - start_time
+    if completed.returncode != 0:
+        raise RuntimeError(f"client.py exited with {completed.returncode}:\n{completed.stderr[-2000:]}")
+    with open(output_file, "r", encoding="utf-8") as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    return completed.stderr, records, elapsed
+
+def run_benchmark(args):
+    """
+    启动测试环境并依次执行冷启动测试和各并发级别的负载测试，返回测试结果。
+    """
+    results = {
+        "config": {
+            "model_type": args.model_type,
+            "stream": args.stream,
+            "warm_up": args.warm_up,
+            "queries": args.queries,
+            "pages_per_query": args.pages,
+            "llm_latency": args.llm_latency,
+            "fetch_cache": args.fetch_cache,
+        },
+        "stages": {},
+    }
+    with tempfile.TemporaryDirectory(prefix="mcp-bench-") as workdir:
+        site_dir = os.path.join(workdir, "site")
+        os.makedirs(site_dir)
+        build_fixture_site(site_dir)
+        site_port, llm_port, server_port = free_port(), free_port(), free_port()
+        httpd = start_fixture_site(site_dir, site_port)
+        llm = start_fake_llm(create_fake_llm(f"http://127.0.0.1:{site_port}", args.pages, args.llm_latency), llm_port)
+        server_log = os.path.join(workdir, "server.log")
+        server, log = start_mcp_server(server_port, server_log, args.fetch_cache)
+
+        config_file = os.path.join(workdir, "mcp_config.json")
+        with open(config_file, "w", encoding="utf-8") as f:
+            json.dump({"mcpServers": {"fetch-server": {
+                "type": "sse", "url": f"http://127.0.0.1:{server_port}/sse"}}}, f)
+        model_url = f"http://127.0.0.1:{llm_port}" + ("/v1" if args.model_type == "openai" else "")
+        log_offset = 0
+
+        try:
+            # 冷启动：每次启动新的客户端进程执行一个查询，统计启动到可以接受输入的耗时、工具发现、
+            # 会话建立、第一轮模型调用和进程总耗时
+            cold = {"startup": [], "discovery": [], "session_setup": [], "first_turn": [], "process": []}
+            for i in range(args.cold_runs):
+                stderr, records, elapsed = run_client(args, workdir, model_url, config_file, 1, 1)
+                samples = parse_samples(stderr, client_stage_patterns)
+                cold["startup"] += samples["startup"]
+                cold["discovery"] += samples["discovery"]
+                cold["session_setup"] += samples["session_setup"]
+                cold["first_turn"] += samples["llm_turn"][:1]
+                cold["process"].append(elapsed)
+                _, log_offset = read_new_log(server_log, log_offset)
+                print(f"cold run {i + 1}/{args.cold_runs}: {elapsed:.3f} seconds")
+            results["stages"]["cold"] = {stage: summarize(values) for stage, values in cold.items()}
+
+            # 负载：N个对话并发执行，统计各环节耗时、对话耗时和吞吐量
+            for concurrency in args.concurrency:
+                stderr, records, elapsed = run_client(args, workdir, model_url, config_file, args.queries, concurrency)
+                server_text, log_offset = read_new_log(server_log, log_offset)
+                samples = parse_samples(stderr, client_stage_patterns)
+                samples.update(parse_samples(server_text, server_stage_patterns))
+                # 工具发现和会话建立每个进程只有一次，只在冷启动测试中统计
+                stages = {stage: summarize(values) for stage, values in samples.items()
+                          if values and stage not in cold}
+                stages["conversation"] = summarize([record["duration"] for record in records])
+                match = batch_pattern.search(stderr)
+                total, failed, duration = int(match.group(1)), int(match.group(2)), float(match.group(3))
+                stages["throughput"] = total / duration if duration > 0 else 0
+                stages["failed"] = failed
+                results["stages"][f"concurrency-{concurrency}"] = stages
+                print(f"concurrency {concurrency}: {total} conversations ({failed} failed) in {duration:.3f} seconds")
+        finally:
+            server.terminate()
+            try:
+                server.wait(10)
+            except subprocess.TimeoutExpired:
+                server.kill()
+            log.close()
+            llm.should_exit = True
+            httpd.shutdown()
+    return results
+
+def print_results(results):
+    print()
+    print(f"{'stage':<32}{'count':>8}{'p50 ms':>12}{'p95 ms':>12}{'p99 ms':>12}")
+    for group, stages in results["stages"].items():
+        for stage, value in stages.items():
+            name = f"{group}/{stage}"
+            if isinstance(value, dict):
+                row = "".join(f"{value[key] * 1000:>12.1f}" if value[key] is not None else f"{'-':>12}"
+                              for key in ("p50", "p95", "p99"))
+                print(f"{name:<32}{value['count']:>8}{row}")
+            elif stage == "throughput":
+                print(f"{name:<32}{value:>8.2f} conversations/second")
+            else:
+                print(f"{name:<32}{value:>8}")
+
+def compare_with_baseline(results, baseline, tolerance, min_delta=0.005):
+    """
+    将测试结果与基线比较，返回退化的指标列表。
+
+    延迟指标变慢超过tolerance（且绝对差值超过min_delta秒）、吞吐量下降超过tolerance时视为退化。
+    """
+    regressions = []
+    print()
+    print(f"Compared with baseline (tolerance {tolerance:.0%}):")
+    for group, stages in results["stages"].items():
+        for stage, value in stages.items():
+            old = baseline.get("stages", {}).get(group, {}).get(stage)
+            if old is None or stage == "failed":
+                continue
+            if stage == "throughput":
+                if not old:
+                    continue
+                change = value / old - 1
+                regressed = change < -tolerance
+                print(f"  {group}/{stage}: {old:.2f} -> {value:.2f} conversations/second ({change:+.1%})"
+                      + (" REGRESSION" if regressed else ""))
+            else:
+                if not old.get("p95") or value.get("p95") is None:
+                    continue
+                change = value["p95"] / old["p95"] - 1
+                regressed = change > tolerance and value["p95"] - old["p95"] > min_delta
+                print(f"  {group}/{stage} p95: {old['p95'] * 1000:.1f} -> {value['p95'] * 1000:.1f} ms ({change:+.1%})"
+                      + (" REGRESSION" if regressed else ""))
+            if regressed:
+                regressions.append(f"{group}/{stage}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='离线运行MCP客户端和服务器的端到端性能测试')
+    parser.add_argument('-t', '--model-type', type=str, choices=['openai', 'ollama'], default=model_type,
+                        help='模拟的模型服务类型：openai或ollama')
+    parser.add_argument('--stream', action='store_true',
+                        help='客户端以流式方式接收模型输出')
+    parser.add_argument('--warm-up', action='store_true',
+                        help='客户端在获取工具列表的同时预热模型服务')
+    parser.add_argument('--concurrency', type=lambda value: [int(item) for item in value.split(",")],
+                        default=concurrency_levels, help='负载测试的并发对话数，多个级别以逗号分隔')
+    parser.add_argument('--queries', type=int, default=queries_per_level,
+                        help='每个并发级别执行的对话数')
+    parser.add_argument('--cold-runs', type=int, default=cold_runs,
+                        help='冷启动测试的次数，每次启动新的客户端进程')
+    parser.add_argument('--pages', type=int, default=pages_per_query,
+                        help='模拟的模型在每个对话中调用fetch的次数')
+    parser.add_argument('--llm-latency', type=float, default=llm_latency,
+                        help='模拟的模型每次响应前的等待时间（秒）')
+    parser.add_argument('--fetch-cache', action='store_true',
+                        help='启用服务器的fetch缓存，默认关闭以测量每次的下载和提取')
+    parser.add_argument('--baseline', type=str, default=baseline_file,
+                        help='基线结果文件路径')
+    parser.add_argument('--save-baseline', action='store_true',
+                        help='将本次结果保存为基线')
+    parser.add_argument('--tolerance', type=float, default=tolerance,
+                        help='与基线比较时允许的退化比例')
+    parser.add_argument('-o', '--output', type=str, default=None,
+                        help='保存本次结果的JSON文件路径')
+    args = parser.parse_args()
+
+    results = run_benchmark(args)
+    print_results(results)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nBaseline saved to {args.baseline}")
+    elif os.path.exists(args.baseline):
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        if baseline.get("config") != results["config"]:
+            print("\nBaseline was recorded with a different configuration, skipping comparison:",
+                  baseline.get("config"))
+            return
+        regressions = compare_with_baseline(results, baseline, args.tolerance)
+        if regressions:
+            print("Regressions:", ", ".join(regressions))
+            sys.exit(1)
+    else:
+        print(f"\nNo baseline at {args.baseline}, run with --save-baseline to record one")
+
+if __name__ == "__main__":
+    main()
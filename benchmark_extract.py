@@ -0,0 +1,129 @@
+import argparse
+import glob
+import os
+import re
+import statistics
+import tempfile
+import time
+from collections import Counter
+
+from extractors import extractors
+
+# 比较各正文提取引擎的速度和输出质量
+reference_engine = "readability"
+repeat = 3
+word_pattern = re.compile(r"\w+")
+
+
+def load_corpus(directory):
+    """
+    读取目录中的HTML文件，同名的.md文件（如存在）作为期望输出。
+
+    返回：
+        list: [(文件名, HTML, 期望输出或None)]
+    """
+    corpus = []
+    for path in sorted(glob.glob(os.path.join(directory, "*.html")) + glob.glob(os.path.join(directory, "*.htm"))):
+        with open(path, "rb") as f:
+            html = f.read().decode("utf-8", errors="replace")
+        expected = None
+        expected_path = os.path.splitext(path)[0] + ".md"
+        if os.path.exists(expected_path):
+            with open(expected_path, "r", encoding="utf-8") as f:
+                expected = f.read()
+        corpus.append((os.path.basename(path), html, expected))
+    return corpus
+
+def word_f1(output, reference):
+    """
+    按词计算输出相对参考文本的F1，忽略Markdown标记和词序。
+    """
+    output_words = Counter(word_pattern.findall(output.lower()))
+    reference_words = Counter(word_pattern.findall(reference.lower()))
+    if not output_words and not reference_words:
+        return 1.0
+    overlap = sum((output_words & reference_words).values())
+    if overlap == 0:
+        return 0.0
+    precision = overlap / sum(output_words.values())
+    recall = overlap / sum(reference_words.values())
+    return 2 * precision * recall / (precision + recall)
+
+def time_extraction(engine, html, repeat):
+    """
+    重复提取repeat次，返回(输出, 最短耗时)。
+    """
+    best = None
+    markdown = None
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        markdown, _ = extractors[engine].extract(html)
+        elapsed = time.perf_counter() - start_time
+        best = elapsed if best is None else min(best, elapsed)
+    return markdown, best
+
+def run(corpus, engines, reference, repeat):
+    results = {engine: {"times": [], "f1": [], "length_ratio": []} for engine in engines}
+    total_bytes = sum(len(html.encode("utf-8")) for _, html, _ in corpus)
+    for name, html, expected in corpus:
+        outputs = {}
+        for engine in engines:
+            outputs[engine], elapsed = time_extraction(engine, html, repeat)
+            results[engine]["times"].append(elapsed)
+        # 有期望输出时与期望输出比较，否则与参考引擎的输出比较
+        baseline = expected if expected is not None else outputs[reference]
+        line = [f"{name:<32}"]
+        for engine in engines:
+            f1 = word_f1(outputs[engine], baseline)
+            results[engine]["f1"].append(f1)
+            results[engine]["length_ratio"].append(len(outputs[engine]) / max(1, len(baseline)))
+            line.append(f"{engine} {results[engine]['times'][-1] * 1000:8.1f} ms F1 {f1:.3f}")
+        print("  ".join(line))
+
+    print()
+    print(f"{len(corpus)} documents, {total_bytes / 1024 / 1024:.2f} MB, fidelity against "
+          f"{'expected .md files where present, otherwise ' if any(item[2] for item in corpus) else ''}{reference}")
+    print(f"{'engine':<14}{'total s':>10}{'p50 ms':>10}{'max ms':>10}{'MB/s':>10}{'mean F1':>10}{'min F1':>10}{'len ratio':>11}")
+    for engine in engines:
+        times = results[engine]["times"]
+        total = sum(times)
+        print(f"{engine:<14}{total:>10.3f}{statistics.median(times) * 1000:>10.1f}{max(times) * 1000:>10.1f}"
+              f"{total_bytes / 1024 / 1024 / total if total else 0:>10.2f}"
+              f"{statistics.mean(results[engine]['f1']):>10.3f}{min(results[engine]['f1']):>10.3f}"
+              f"{statistics.mean(results[engine]['length_ratio']):>11.2f}")
+    reference_total = sum(results[reference]["times"])
+    for engine in engines:
+        if engine != reference and sum(results[engine]["times"]):
+            print(f"{engine} is {reference_total / sum(results[engine]['times']):.1f}x the speed of {reference}")
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description='比较正文提取引擎的速度和输出质量')
+    parser.add_argument('--corpus', type=str, default=None,
+                        help='HTML文件所在目录，同名.md文件作为期望输出；未指定时使用生成的测试页面')
+    parser.add_argument('--engines', type=lambda value: value.split(","), default=",".join(extractors),
+                        help='参与比较的引擎，以逗号分隔')
+    parser.add_argument('--reference', type=str, default=reference_engine,
+                        help='没有期望输出时作为质量参考的引擎')
+    parser.add_argument('--repeat', type=int, default=repeat,
+                        help='每个文件的重复提取次数，取最短耗时')
+    args = parser.parse_args()
+
+    for engine in args.engines + [args.reference]:
+        if engine not in extractors:
+            parser.error(f"unknown engine '{engine}', available: {', '.join(extractors)}")
+    engines = list(dict.fromkeys([args.reference] + args.engines))
+
+    if args.corpus:
+        corpus = load_corpus(args.corpus)
+    else:
+        from benchmark import build_fixture_site
+        with tempfile.TemporaryDirectory(prefix="mcp-extract-") as directory:
+            build_fixture_site(directory)
+            corpus = load_corpus(directory)
+    if not corpus:
+        parser.error("no HTML files in the corpus")
+    run(corpus, engines, args.reference, args.repeat)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+from mcp.client.session import ClientSession
+from mcp.client.sse import sse_client
+from mcp.client.stdio import StdioServerParameters, stdio_client
+from mcp.client.streamable_http import streamablehttp_client
+
+from benchmark import base_dir, build_fixture_site, free_port, percentile, start_fixture_site, start_mcp_server
+
+# 比较server.py在各传输方式下单次调用的开销，服务器和测试网站都在本地运行
+transports = ("sse", "streamable-http", "stdio")
+calls_per_operation = 200
+fixture_page = "small.html"
+
+
+def open_streams(transport, port, log):
+    """
+    按传输方式连接服务器，stdio方式下由客户端启动服务器进程。
+    """
+    if transport == "sse":
+        return sse_client(f"http://127.0.0.1:{port}/sse")
+    if transport == "streamable-http":
+        return streamablehttp_client(f"http://127.0.0.1:{port}/mcp/")
+    env = os.environ.copy()
+    env.update({"FETCH_CACHE": "1", "PYTHONUNBUFFERED": "1"})
+    return stdio_client(StdioServerParameters(
+        command=sys.executable, args=[os.path.join(base_dir, "server.py"), "--transport", "stdio"],
+        env=env, cwd=base_dir), errlog=log)
+
+async def time_calls(call, count):
+    """
+    依次执行count次调用，返回每次的耗时（秒）。
+    """
+    times = []
+    for _ in range(count):
+        start_time = time.perf_counter()
+        await call()
+        times.append(time.perf_counter() - start_time)
+    return times
+
+async def run_transport(transport, page_url, calls, log_path):
+    """
+    连接一种传输方式的服务器，返回建立会话的耗时和各操作每次调用的耗时。
+    """
+    port = free_port()
+    process = None
+    if transport == "stdio":
+        log = open(log_path, "w", encoding="utf-8")
+    else:
+        process, log = start_mcp_server(port, log_path, fetch_cache=True, transport=transport)
+    try:
+        start_time = time.perf_counter()
+        async with open_streams(transport, port, log) as streams:
+            async with ClientSession(streams[0], streams[1]) as session:
+                await session.initialize()
+                results = {"setup": time.perf_counter() - start_time}
+                # 第一次fetch下载并提取页面，之后的调用命中服务器的缓存，耗时主要是传输开销
+                await session.call_tool("fetch", {"url": page_url})
+                results["list_tools"] = await time_calls(session.list_tools, calls)
+                results["fetch"] = await time_calls(lambda: session.call_tool("fetch", {"url": page_url}), calls)
+                return results
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait(10)
+        log.close()
+
+def print_results(results):
+    print(f"{'transport':<18}{'setup ms':>10}{'operation':>12}{'p50 ms':>10}{'p95 ms':>10}{'mean ms':>10}{'calls/s':>10}")
+    for transport, result in results.items():
+        for operation in ("list_tools", "fetch"):
+            times = result[operation]
+            print(f"{transport:<18}{result['setup'] * 1000:>10.1f}{operation:>12}"
+                  f"{percentile(times, 50) * 1000:>10.2f}{percentile(times, 95) * 1000:>10.2f}"
+                  f"{statistics.mean(times) * 1000:>10.2f}{len(times) / sum(times):>10.0f}")
+    reference = results.get("sse")
+    if reference:
+        for transport, result in results.items():
+            if transport != "sse":
+                ratio = statistics.median(reference["fetch"]) / statistics.median(result["fetch"])
+                print(f"{transport} fetch p50 is {ratio:.1f}x the speed of sse")
+
+def main():
+    parser = argparse.ArgumentParser(description='比较MCP服务器各传输方式的单次调用开销')
+    parser.add_argument('--transports', type=lambda value: value.split(","), default=",".join(transports),
+                        help='参与比较的传输方式，以逗号分隔')
+    parser.add_argument('--calls', type=int, default=calls_per_operation,
+                        help='每种操作（list_tools和命中缓存的fetch）依次执行的次数')
+    args = parser.parse_args()
+
+    for transport in args.transports:
+        if transport not in transports:
+            parser.error(f"unknown transport '{transport}', available: {', '.join(transports)}")
+
+    with tempfile.TemporaryDirectory(prefix="mcp-transport-") as workdir:
+        site_dir = os.path.join(workdir, "site")
+        os.makedirs(site_dir)
+        build_fixture_site(site_dir)
+        site_port = free_port()
+        site = start_fixture_site(site_dir, site_port)
+        page_url = f"http://127.0.0.1:{site_port}/{fixture_page}"
+        results = {}
+        try:
+            for transport in args.transports:
+                log_path = os.path.join(workdir, f"server-{transport}.log")
+                results[transport] = asyncio.run(run_transport(transport, page_url, args.calls, log_path))
+        finally:
+            site.shutdown()
+    print_results(results)
+
+if __name__ == "__main__":
+    main()
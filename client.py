@@ -1,16 +1,28 @@
+import time
+# 记录启动时间，冷启动耗时包括导入依赖的时间
+client_start_time = time.time()
 import argparse
 import asyncio
 import json
-import boto3
 import logging
 import datetime
-import time
+import hashlib
+import sqlite3
+import sys
+import threading
+import urllib.request
 from mcp.client.session import ClientSession
 from mcp.client.sse import sse_client
-from ollama import ChatResponse, Client
-from openai import OpenAI
+from mcp.shared.exceptions import McpError
+from mcp.types import CONNECTION_CLOSED
+import anyio
+import httpx
 import os
-from dataclasses import dataclass
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from urllib.parse import urlsplit
 
 # 定义 Context 类
 @dataclass
@@ -20,7 +32,24 @@ class Context:
     messages: list
     with_tools: bool = False
     services: list = None
-    combined_tools: list = None    
+    registry: object = None
+    session_manager: object = None
+    provider: object = None
+    tool_result_cache: object = None
+    background_tasks: set = field(default_factory=set)
+
+# 定义 Conversation 类，保存单个对话的消息和统计信息，
+# 批量模式下每个查询各有一个，共享Context中的MCP会话池和模型客户端
+@dataclass
+class Conversation:
+    messages: list
+    window: object = None
+    interactive: bool = True
+    max_turns: int = 0
+    turns: int = 0
+    tool_calls: int = 0
+    model_seconds: float = 0
+    tool_seconds: float = 0
 
 context = Context(None, None, [])
 model_type = "ollama"
@@ -31,6 +60,26 @@ service_name = None
 system_promt = "You are a helpful AI assistant. " + \
     "使用中文回答, " #", Use Wiki website first, "
 start_query = None
+model_timeout = 300
+model_retries = 2
+model_max_connections = 10
+context_budget = 16000
+keep_recent_turns = 2
+tool_summary_chars = 500
+tools_cache_file = ".mcp_tools_cache.json"
+tools_cache_ttl = 3600
+tool_result_cache_file = ""
+tool_result_ttl = 300
+tool_result_max_entries = 1000
+discovery_timeout = 10
+watch_config_interval = 2
+max_concurrent_tools = 4
+tool_timeout = 60
+ollama_keep_alive = None
+ollama_num_ctx = 0
+batch_output = "batch_results.jsonl"
+batch_concurrency = 4
+batch_max_turns = 10
 
 # 配置日志格式，包含毫秒级时间戳
 logging.basicConfig(
@@ -41,6 +90,39 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
+async def read_in_daemon_thread(func, *args):
+    """
+    在守护线程中执行阻塞的读取（input()或标准输入的readline）。
+
+    asyncio.to_thread使用的线程池在退出时会等待线程结束，阻塞在input()中的线程会使Ctrl-C要等到回车后才能退出；
+    守护线程不会被等待。
+    """
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+
+    def deliver(result, error):
+        if future.done():
+            return
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def target():
+        result = error = None
+        try:
+            result = func(*args)
+        except BaseException as err:
+            error = err
+        try:
+            loop.call_soon_threadsafe(deliver, result, error)
+        except RuntimeError:
+            # 事件循环已关闭
+            pass
+
+    threading.Thread(target=target, name="input-reader", daemon=True).start()
+    return await future
+
 def handle_input(promt="请继续输入对话内容: "):
     """
     检查用户输入是否需要继续对话。
@@ -64,7 +146,7 @@ def handle_input(promt="请继续输入对话内容: "):
             context.messages.append(context.system_message)  # 修复：清空并追加 system_message
             print("Messages reset to system message.")
         elif user_input.lower() == "tools":
-            print("Available tools:", context.combined_tools)
+            print("Available tools:", context.registry.tools)
         elif user_input.lower() == "services":
             print("Available services:", context.services)
         elif user_input.lower() == "model":
@@ -103,73 +185,625 @@ def load_mcp_services(config_file, service_name=None):
 
     return [{"name": name, **details} for name, details in services.items()]
 
-async def fetch_and_combine_tools(services):
+@asynccontextmanager
+async def open_service_streams(service):
+    """
+    根据服务类型建立到MCP服务的传输连接。
+
+    参数：
+        service (dict): MCP服务配置
+
+    返回：
+        tuple: (read_stream, write_stream)
+    """
+    service_type = service.get('type', 'stdio').lower()
+
+    if service_type == 'sse':
+        async with sse_client(service['url']) as streams:
+            yield streams
+    elif service_type == 'streamable-http':
+        from mcp.client.streamable_http import streamablehttp_client
+
+        async with streamablehttp_client(service['url']) as streams:
+            yield streams[0], streams[1]
+    elif service_type == 'stdio':
+        from mcp.client.stdio import stdio_client, StdioServerParameters
+
+        process_env = os.environ.copy()
+        if 'env' in service:
+            process_env.update(service['env'])
+
+        cmd = StdioServerParameters(
+            command=service['command'].split()[0],
+            args=service['command'].split()[1:],
+            env=process_env
+        )
+        async with stdio_client(cmd) as streams:
+            yield streams
+    else:
+        raise ValueError(f"Unsupported service type: {service_type}")
+
+def is_transport_error(err):
+    """
+    判断工具调用的异常是否由连接失效引起，参数错误或服务端返回的错误不需要重连。
+    """
+    if isinstance(err, McpError):
+        return err.error.code == CONNECTION_CLOSED
+    return isinstance(err, (anyio.ClosedResourceError, anyio.BrokenResourceError, anyio.EndOfStream,
+                            httpx.TransportError, ConnectionError, OSError))
+
+class ServiceSession:
+    """
+    单个MCP服务的长连接会话。
+
+    连接由一个独立的后台任务持有，保证传输层的上下文在同一个任务中进入和退出；
+    调用方通过get()取得可用的ClientSession，连接断开后下一次get()会自动重连。
+    """
+
+    def __init__(self, service, connect_timeout=30):
+        self.service = service
+        self.connect_timeout = connect_timeout
+        self.session = None
+        self._task = None
+        self._ready = None
+        self._stop = None
+        self._error = None
+        self._lock = asyncio.Lock()
+        self._in_flight = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+    @property
+    def alive(self):
+        return self.session is not None and self._task is not None and not self._task.done()
+
+    async def _run(self):
+        try:
+            async with open_service_streams(self.service) as streams:
+                async with ClientSession(streams[0], streams[1]) as session:
+                    await session.initialize()
+                    self.session = session
+                    self._ready.set()
+                    await self._stop.wait()
+        except Exception as err:
+            self._error = err
+            logger.warning("Session of service %s closed: %s", self.service['name'], str(err))
+        finally:
+            self.session = None
+            self._ready.set()
+
+    async def _connect(self):
+        self._ready = asyncio.Event()
+        self._stop = asyncio.Event()
+        self._error = None
+        start_time = time.time()
+        self._task = asyncio.create_task(self._run(), name=f"mcp-session-{self.service['name']}")
+        try:
+            await asyncio.wait_for(self._ready.wait(), self.connect_timeout)
+        except asyncio.TimeoutError:
+            await self._shutdown()
+            raise TimeoutError(f"Timed out connecting to service {self.service['name']}")
+        if self.session is None:
+            raise ConnectionError(f"Failed to connect to service {self.service['name']}: {self._error}")
+        logger.info("Session of service %s initialized in %.3f seconds",
+                    self.service['name'], time.time() - start_time)
+
+    async def _shutdown(self):
+        if self._task is None:
+            return
+        self._stop.set()
+        if not self._task.done():
+            try:
+                await asyncio.wait_for(asyncio.shield(self._task), 5)
+            except Exception:
+                self._task.cancel()
+        self._task = None
+        self.session = None
+
+    async def get(self):
+        """
+        返回可用的会话，尚未连接或连接已断开时建立新连接。
+        """
+        async with self._lock:
+            if not self.alive:
+                await self._shutdown()
+                await self._connect()
+            return self.session
+
+    async def reset(self, failed_session=None):
+        """
+        关闭当前连接，下一次get()时重新连接。
+
+        指定failed_session时，只有当前连接仍是失败的那个时才关闭，避免并发的调用重复关闭已经重建的连接。
+        """
+        async with self._lock:
+            if failed_session is not None and self.session is not failed_session:
+                return
+            await self._shutdown()
+
+    async def call_tool(self, tool_name, arguments):
+        """
+        调用工具，连接失效时重连并重试一次，其他错误直接抛出。
+        """
+        self._in_flight += 1
+        self._idle.clear()
+        try:
+            session = await self.get()
+            try:
+                return await session.call_tool(tool_name, arguments)
+            except Exception as err:
+                if not is_transport_error(err):
+                    raise
+                logger.warning("Call to %s on service %s failed (%s), reconnecting",
+                               tool_name, self.service['name'], str(err))
+                await self.reset(session)
+                session = await self.get()
+                return await session.call_tool(tool_name, arguments)
+        finally:
+            self._in_flight -= 1
+            if self._in_flight == 0:
+                self._idle.set()
+
+    async def close(self):
+        await self.reset()
+
+    async def drain_and_close(self):
+        """
+        等待进行中的工具调用完成后再关闭连接。
+        """
+        await self._idle.wait()
+        await self.close()
+
+class MCPSessionManager:
+    """
+    MCP服务会话池，每个服务只建立一次连接并在整个客户端生命周期内复用。
+    """
+
+    def __init__(self, services, connect_timeout=30):
+        self.connect_timeout = connect_timeout
+        self._sessions = {}
+        for service in services or []:
+            self.add_service(service)
+
+    def add_service(self, service):
+        if service['name'] not in self._sessions:
+            self._sessions[service['name']] = ServiceSession(service, self.connect_timeout)
+
+    def remove_service(self, name):
+        """
+        移除服务，新的调用立即不再路由到该服务。
+
+        返回：
+            asyncio.Task: 等待进行中的调用完成后关闭连接的任务，服务不存在时为None
+        """
+        service_session = self._sessions.pop(name, None)
+        if service_session:
+            return asyncio.create_task(service_session.drain_and_close())
+        return None
+
+    async def get_session(self, name):
+        if name not in self._sessions:
+            raise ValueError(f"Service {name} not found")
+        return await self._sessions[name].get()
+
+    async def call_tool(self, name, tool_name, arguments):
+        """
+        在指定服务上调用工具，连接失效时重连并重试一次。
+        """
+        if name not in self._sessions:
+            raise ValueError(f"Service {name} not found")
+        return await self._sessions[name].call_tool(tool_name, arguments)
+
+    async def close(self):
+        for service_session in list(self._sessions.values()):
+            await service_session.close()
+
+class ToolRegistry:
+    """
+    工具注册表，按工具名直接索引到所属服务和工具定义。
+
+    不同服务存在同名工具时，以"服务名__工具名"的形式对外暴露以避免冲突；
+    工具变化时重新生成对外的工具列表和模型所需格式的工具，查找时无需再遍历。
+    """
+
+    separator = "__"
+
+    def __init__(self):
+        self._service_tools = {}
+        self._index = {}
+        self.tools = []
+        self.converted_tools = []
+
+    def __len__(self):
+        return len(self._index)
+
+    def update(self, tools):
+        """
+        用tools替换其中涉及的服务的全部工具。
+        """
+        by_service = {}
+        for tool in tools:
+            by_service.setdefault(tool['serviceName'], []).append(tool)
+        self._service_tools.update(by_service)
+        self._rebuild()
+
+    def remove_service(self, service_name):
+        if self._service_tools.pop(service_name, None) is not None:
+            self._rebuild()
+
+    def lookup(self, name):
+        """
+        返回(服务名, 工具在服务中的原始名称)。
+        """
+        if name not in self._index:
+            raise ValueError(f"Tool {name} not found in any service")
+        tool = self._index[name]
+        return tool['serviceName'], tool['name']
+
+    def _rebuild(self):
+        counts = {}
+        for tools in self._service_tools.values():
+            for tool in tools:
+                counts[tool['name']] = counts.get(tool['name'], 0) + 1
+
+        index = {}
+        exposed_tools = []
+        for service_name, tools in self._service_tools.items():
+            for tool in tools:
+                name = tool['name']
+                if counts[name] > 1:
+                    name = f"{service_name}{self.separator}{name}"
+                    logger.warning("Tool %s is provided by several services, exposed as %s", tool['name'], name)
+                index[name] = tool
+                exposed_tools.append({**tool, "name": name})
+
+        self._index = index
+        self.tools = exposed_tools
+        self.converted_tools = convert_tool_format(exposed_tools)
+
+class ToolsCache:
+    """
+    工具列表的磁盘缓存，按服务配置的哈希作为键，记录获取时间用于判断是否过期。
     """
-    遍历MCP服务列表，获取并拼接为完整的工具列表。
+
+    def __init__(self, cache_file, ttl=3600):
+        self.cache_file = cache_file
+        self.ttl = ttl
+        self._entries = {}
+        if cache_file and os.path.exists(cache_file):
+            try:
+                with open(cache_file, 'r', encoding='utf-8') as f:
+                    self._entries = json.load(f)
+            except (OSError, ValueError) as err:
+                logger.warning("Failed to load tools cache %s: %s", cache_file, str(err))
+
+    @staticmethod
+    def service_key(service):
+        return hashlib.sha256(json.dumps(service, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def get(self, service):
+        """
+        返回(工具列表, 是否未过期)，没有缓存时返回(None, False)。
+        """
+        entry = self._entries.get(self.service_key(service))
+        if entry is None:
+            return None, False
+        return entry['tools'], time.time() - entry['timestamp'] < self.ttl
+
+    def put(self, service, tools):
+        self._entries[self.service_key(service)] = {"timestamp": time.time(), "tools": tools}
+        self.save()
+
+    def save(self):
+        if not self.cache_file:
+            return
+        tmp_file = self.cache_file + ".tmp"
+        try:
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                json.dump(self._entries, f, ensure_ascii=False)
+            os.replace(tmp_file, self.cache_file)
+        except OSError as err:
+            logger.warning("Failed to save tools cache %s: %s", self.cache_file, str(err))
+
+class ToolResultCache:
+    """
+    工具调用结果的缓存，键为服务名、工具名和规范化后的参数。
+
+    只缓存在服务配置的toolCache中声明的工具，例如{"fetch": {"ttl": 600, "maxEntries": 500}}，
+    声明为true时使用--tool-result-ttl和默认的条目数上限。每个工具在内存中有独立的LRU缓存；
+    指定了store_file时同时写入SQLite数据库，多个批量运行的进程可以共享。调用失败的结果不缓存。
+
+    SQLite的读写在单独的线程中执行，并使用较短的锁等待时间：多个进程争用数据库时只会使持久化存储未命中或跳过写入，
+    不会阻塞事件循环上的其他对话。
+    """
+
+    def __init__(self, store_file=None, default_ttl=300, default_max_entries=1000, store_timeout=0.5):
+        self.default_ttl = default_ttl
+        self.default_max_entries = default_max_entries
+        self._policies = {}
+        self._entries = {}
+        self.hits = 0
+        self.misses = 0
+        self._db = None
+        self._store = None
+        if store_file:
+            # 数据库连接只在这个线程中使用
+            self._store = ThreadPoolExecutor(max_workers=1, thread_name_prefix="tool-result-store")
+            self._store.submit(self._open_store, store_file, store_timeout).result()
+
+    def _open_store(self, store_file, store_timeout):
+        try:
+            self._db = sqlite3.connect(store_file, timeout=store_timeout)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute("CREATE TABLE IF NOT EXISTS tool_results "
+                             "(key TEXT PRIMARY KEY, service TEXT, tool TEXT, result TEXT, expires_at REAL)")
+            self._db.execute("DELETE FROM tool_results WHERE expires_at < ?", (time.time(),))
+            self._db.commit()
+        except sqlite3.Error as err:
+            logger.warning("Failed to open tool result store %s: %s", store_file, str(err))
+            self._db = None
+
+    def configure(self, services):
+        """
+        根据服务配置中的toolCache更新各工具的缓存策略。
+        """
+        policies = {}
+        for service in services:
+            for tool_name, setting in (service.get('toolCache') or {}).items():
+                if setting is False or setting is None:
+                    continue
+                setting = setting if isinstance(setting, dict) else {}
+                policies[(service['name'], tool_name)] = (
+                    float(setting.get('ttl', self.default_ttl)),
+                    int(setting.get('maxEntries', self.default_max_entries)))
+        self._policies = policies
+        for key in list(self._entries):
+            if key not in policies:
+                del self._entries[key]
+
+    def cacheable(self, service_name, tool_name):
+        return (service_name, tool_name) in self._policies
+
+    @staticmethod
+    def cache_key(service_name, tool_name, arguments):
+        if not isinstance(arguments, str):
+            arguments = json.dumps(arguments, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+        return hashlib.sha256(f"{service_name}\0{tool_name}\0{arguments}".encode('utf-8')).hexdigest()
+
+    async def get(self, service_name, tool_name, arguments):
+        """
+        返回缓存的结果文本，未命中或已过期时返回None，并说明命中的是内存还是持久化存储。
+        """
+        policy = (service_name, tool_name)
+        if policy not in self._policies:
+            return None, None
+        entries = self._entries.setdefault(policy, OrderedDict())
+        key = self.cache_key(service_name, tool_name, arguments)
+        now = time.time()
+        entry = entries.get(key)
+        if entry is not None:
+            if entry[1] > now:
+                entries.move_to_end(key)
+                self.hits += 1
+                return entry[0], "memory"
+            del entries[key]
+        if self._store is not None:
+            row = await asyncio.get_running_loop().run_in_executor(self._store, self._store_get, key)
+            if row is not None and row[1] > now:
+                self._remember(policy, key, row[0], row[1])
+                self.hits += 1
+                return row[0], "store"
+        self.misses += 1
+        return None, None
+
+    def put(self, service_name, tool_name, arguments, result):
+        """
+        缓存结果；写入持久化存储在后台进行，不等待完成。
+        """
+        policy = (service_name, tool_name)
+        settings = self._policies.get(policy)
+        if settings is None:
+            # 调用期间配置重新加载，该工具已不再缓存
+            return
+        key = self.cache_key(service_name, tool_name, arguments)
+        expires_at = time.time() + settings[0]
+        self._remember(policy, key, result, expires_at)
+        if self._store is not None:
+            self._store.submit(self._store_put, key, service_name, tool_name, result, expires_at)
+
+    def _store_get(self, key):
+        if self._db is None:
+            return None
+        try:
+            return self._db.execute("SELECT result, expires_at FROM tool_results WHERE key = ?", (key,)).fetchone()
+        except sqlite3.Error as err:
+            logger.warning("Failed to read tool result store: %s", str(err))
+            return None
+
+    def _store_put(self, key, service_name, tool_name, result, expires_at):
+        if self._db is None:
+            return
+        try:
+            self._db.execute("INSERT OR REPLACE INTO tool_results VALUES (?, ?, ?, ?, ?)",
+                             (key, service_name, tool_name, result, expires_at))
+            self._db.commit()
+        except sqlite3.Error as err:
+            logger.warning("Failed to write tool result store: %s", str(err))
+
+    def _remember(self, policy, key, result, expires_at):
+        settings = self._policies.get(policy)
+        if settings is None:
+            return
+        entries = self._entries.setdefault(policy, OrderedDict())
+        entries[key] = (result, expires_at)
+        entries.move_to_end(key)
+        while len(entries) > settings[1]:
+            entries.popitem(last=False)
+
+    def _close_store(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    def close(self):
+        if self.hits or self.misses:
+            logger.info("Tool result cache: %d hits, %d misses", self.hits, self.misses)
+        if self._store is not None:
+            # 等待尚未完成的写入
+            self._store.submit(self._close_store)
+            self._store.shutdown(wait=True)
+            self._store = None
+
+async def fetch_service_tools(service, session_manager):
+    """
+    获取单个MCP服务的工具列表。
+    """
+    session = await session_manager.get_session(service['name'])
+    tools_result = await session.list_tools()
+
+    return [{
+        "serviceName": service['name'],
+        "name": tool.name, 
+        "description": tool.description,
+        "inputSchema": tool.inputSchema} for tool in tools_result.tools]
+
+async def fetch_and_combine_tools(services, session_manager, timeout=10, tools_cache=None):
+    """
+    并发获取MCP服务列表中所有服务的工具，并拼接为完整的工具列表。
 
     参数：
         services (list): MCP服务列表
+        session_manager (MCPSessionManager): MCP服务会话池
+        timeout (float): 单个服务获取工具的超时时间（秒）
+        tools_cache (ToolsCache): 工具列表缓存，获取成功后写入
 
     返回：
         list: 拼接后的工具列表
     """
-    combined_tools = []
-
-    for service in services:
+    async def fetch_one(service):
         logger.info("Fetching tools from service: %s", service['name'])
+        start_time = time.time()
         try:
-            service_type = service.get('type', 'stdio').lower()
-
-            if service_type == 'sse':
-                async with sse_client(service['url']) as streams:
-                    async with ClientSession(streams[0], streams[1]) as session:
-                        await session.initialize()
-                        # 稍等片刻，让会话初始化
-                        await asyncio.sleep(1)
-                        logger.info("Session initialized")
-
-                        tools_result = await session.list_tools()
-
-                        tools_list = [{
-                            "serviceName": service['name'],
-                            "name": tool.name, 
-                            "description": tool.description,
-                            "inputSchema": tool.inputSchema} for tool in tools_result.tools]
-                        logger.info("Available tools: %s", tools_list)
-                        combined_tools.extend(tools_list)
-            elif service_type == 'stdio':
-                from mcp.client.stdio import stdio_client, StdioServerParameters
-
-                process_env = os.environ.copy()
-                if 'env' in service:
-                    process_env.update(service['env'])
-
-                cmd = StdioServerParameters(
-                    command=service['command'].split()[0],
-                    args=service['command'].split()[1:],
-                    env=process_env
-                )
-                async with stdio_client(cmd) as streams:
-                    async with ClientSession(streams[0], streams[1]) as session:
-                        await session.initialize()
-
-                        tools_result = await session.list_tools()
-
-                        tools_list = [{
-                            "serviceName": service['name'],
-                            "name": tool.name, 
-                            "description": tool.description,
-                            "inputSchema": tool.inputSchema} for tool in tools_result.tools]
-                        logger.info("Available tools: %s", tools_list)
-                        combined_tools.extend(tools_list)
-            else:
-                raise ValueError(f"Unsupported service type: {service_type}")
-
+            tools_list = await asyncio.wait_for(fetch_service_tools(service, session_manager), timeout)
+        except asyncio.TimeoutError:
+            logger.error("Timed out fetching tools from service %s after %.1f seconds", service['name'], timeout)
+            return None
         except Exception as err:
             logger.error("Failed to fetch tools from service %s: %s", service['name'], str(err))
+            return None
+        logger.info("Available tools from %s (%.3f seconds): %s",
+                    service['name'], time.time() - start_time, tools_list)
+        if tools_cache:
+            tools_cache.put(service, tools_list)
+        return tools_list
+
+    results = await asyncio.gather(*(fetch_one(service) for service in services))
 
+    combined_tools = []
+    for tools_list in results:
+        if tools_list:
+            combined_tools.extend(tools_list)
     return combined_tools  # 返回工具列表
 
+async def revalidate_tools(services, session_manager, tools_cache, registry, timeout=10):
+    """
+    在后台并发重新获取已使用缓存的服务的工具列表，更新缓存和工具注册表。
+    """
+    async def revalidate_one(service):
+        tools_list = await fetch_and_combine_tools([service], session_manager, timeout, tools_cache)
+        if not tools_list:
+            return
+        registry.update(tools_list)
+        logger.info("Revalidated tools of service %s", service['name'])
+
+    await asyncio.gather(*(revalidate_one(service) for service in services))
+
+async def discover_tools(services, session_manager, tools_cache, registry, timeout=10):
+    """
+    获取工具列表并写入工具注册表，优先使用缓存。
+
+    未过期的缓存直接使用；已过期的缓存先使用，同时在后台重新验证；
+    没有缓存的服务并发获取。
+
+    返回：
+        asyncio.Task: 后台重新验证任务，没有需要重新验证的服务时为None
+    """
+    missing, stale = [], []
+    for service in services:
+        tools_list, fresh = tools_cache.get(service)
+        if tools_list is None:
+            missing.append(service)
+            continue
+        logger.info("Using cached tools of service %s%s", service['name'], "" if fresh else " (stale)")
+        registry.update(tools_list)
+        if not fresh:
+            stale.append(service)
+
+    if missing:
+        registry.update(await fetch_and_combine_tools(missing, session_manager, timeout, tools_cache))
+
+    if stale:
+        return asyncio.create_task(revalidate_tools(stale, session_manager, tools_cache, registry, timeout))
+    return None
+
+async def reload_services(services, tools_cache):
+    """
+    按新的服务列表增量更新会话池和工具注册表。
+
+    未变化的服务保留现有会话；被移除或配置变化的服务在进行中的调用完成后关闭。
+    """
+    old_services = {service['name']: service for service in context.services}
+    new_services = {service['name']: service for service in services}
+
+    for name, service in old_services.items():
+        if new_services.get(name) != service:
+            logger.info("Service %s removed or changed, unloading", name)
+            context.registry.remove_service(name)
+            close_task = context.session_manager.remove_service(name)
+            if close_task:
+                track_task(close_task)
+
+    added = [service for name, service in new_services.items() if old_services.get(name) != service]
+    for service in added:
+        logger.info("Service %s added, loading tools", service['name'])
+        context.session_manager.add_service(service)
+
+    context.services = services
+    context.tool_result_cache.configure(services)
+    if added:
+        context.registry.update(await fetch_and_combine_tools(
+            added, context.session_manager, context.args.discovery_timeout, tools_cache))
+    logger.info("Services reloaded, %d tools available", len(context.registry))
+
+async def watch_mcp_config(config_file, service_name, tools_cache, interval=2):
+    """
+    定期检查配置文件的修改时间，文件变化时重新加载服务。
+    """
+    last_mtime = os.stat(config_file).st_mtime if os.path.exists(config_file) else None
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            mtime = os.stat(config_file).st_mtime
+        except OSError:
+            continue
+        if mtime == last_mtime:
+            continue
+        last_mtime = mtime
+        logger.info("Config file %s changed, reloading services", config_file)
+        try:
+            await reload_services(load_mcp_services(config_file, service_name), tools_cache)
+        except Exception as err:
+            logger.error("Failed to reload config file %s: %s", config_file, str(err))
+
+def track_task(task):
+    """
+    记录后台任务，退出时统一取消。
+    """
+    context.background_tasks.add(task)
+    task.add_done_callback(context.background_tasks.discard)
+    return task
+
 async def format_system_promt():
     """
     格式化系统提示信息。
@@ -181,11 +815,23 @@ async def format_system_promt():
 
     logger.info("加载的MCP服务: %s", context.services)
     # 获取并合并所有服务的工具列表
-    context.combined_tools = await fetch_and_combine_tools(context.services)
-    if not context.combined_tools:
+    context.session_manager = MCPSessionManager(context.services)
+    context.registry = ToolRegistry()
+    context.tool_result_cache = ToolResultCache(
+        context.args.tool_result_cache, context.args.tool_result_ttl, tool_result_max_entries)
+    context.tool_result_cache.configure(context.services)
+    tools_cache = ToolsCache(context.args.tools_cache, context.args.tools_cache_ttl)
+    revalidate_task = await discover_tools(
+        context.services, context.session_manager, tools_cache, context.registry, context.args.discovery_timeout)
+    if revalidate_task:
+        track_task(revalidate_task)
+    if context.args.watch_config > 0:
+        track_task(asyncio.create_task(watch_mcp_config(
+            context.args.config_file, context.args.service_name, tools_cache, context.args.watch_config)))
+    if not context.registry.tools:
         logger.warning("未加载到任何工具，请检查配置文件或服务名称")
     else:
-        logger.info("加载的工具: %s", context.combined_tools)
+        logger.info("加载的工具: %s", context.registry.tools)
         with_tools = True
 
     context.with_tools = with_tools
@@ -193,9 +839,10 @@ async def format_system_promt():
     if with_tools:
         system_message = { 
             "role": "system", 
+            # 工具定义已通过tools参数传给模型，不再重复写入系统提示
             "content": system_promt + #", Use Wiki website first, " +
-                "You have access to the following tools: " + json.dumps(context.combined_tools) +
-                 ". Use these tools if called to answer any questions posed by the prompt (user)."}
+                "You have access to tools. " +
+                 "Use these tools if called to answer any questions posed by the prompt (user)."}
     else:
         # 如果没有工具，则使用默认的系统提示信息
         system_message = { 
@@ -230,166 +877,706 @@ def convert_tool_format(tools):
 
     return converted_tools
 
-async def call_tool_with_selected_session(services, combined_tools, tool_name, arguments):
+async def call_tool_with_selected_session(registry, tool_name, arguments):
     """
     根据chat选择的工具，选择相应的MCP服务会话并进行工具调用。
 
     参数：
-        services (list): MCP服务列表
+        registry (ToolRegistry): 工具注册表
         tool_name (str): 选择的工具名称
         arguments (dict): 工具调用的参数
 
     返回：
         dict: 工具调用的结果
     """
-    # 先从combined_tools中查找匹配tool_name的serviceName
-    matching_services = [tool['serviceName'] for tool in combined_tools if tool['name'] == tool_name]
-    if not matching_services:
-        raise ValueError(f"Tool {tool_name} not found in any service")
+    service_name, service_tool_name = registry.lookup(tool_name)
 
-    for service in services:
-        if service['name'] not in matching_services:
-            continue
-        #logger.info("Searching for tool %s in service: %s", tool_name, service['name'])
+    logger.info("Tool %s found in service: %s", tool_name, service_name)
+    cache = context.tool_result_cache
+    cacheable = cache is not None and cache.cacheable(service_name, service_tool_name)
+    if cacheable:
+        start_time = time.perf_counter()
+        cached, source = await cache.get(service_name, service_tool_name, arguments)
+        if cached is not None:
+            logger.info("Tool %s served from %s cache in %.1f microseconds",
+                        tool_name, source, (time.perf_counter() - start_time) * 1e6)
+            return cached
+
+    start_time = time.time()
+    try:
+        tool_response = await context.session_manager.call_tool(service_name, service_tool_name, arguments)
+    except Exception as err:
+        logger.error("Failed to call tool %s in service %s: %s", tool_name, service_name, str(err))
+        raise
+    elapsed_time = time.time() - start_time
+    logger.info("Tool %s executed in %.3f seconds", tool_name, elapsed_time)
+    if cacheable and not getattr(tool_response, 'isError', False):
+        cache.put(service_name, service_tool_name, arguments, format_tool_result(tool_response))
+    return tool_response
+
+def parse_tool_arguments(arguments):
+    """
+    如果arguments是字符串，则需要解析为字典。
+    """
+    if isinstance(arguments, str):
         try:
-            service_type = service.get('type', 'stdio').lower()
-
-            if service_type == 'sse':
-                async with sse_client(service['url']) as streams:
-                    async with ClientSession(streams[0], streams[1]) as session:
-                        await session.initialize()
-                        # 稍等片刻，让会话初始化
-                        await asyncio.sleep(1)
-                        logger.info("Session initialized")
-
-                        logger.info("Tool %s found in service: %s", tool_name, service['name'])
-                        start_time = time.time()
-                        tool_response = await session.call_tool(tool_name, arguments)
-                        elapsed_time = time.time() - start_time
-                        logger.info("Tool %s executed in %.3f seconds", tool_name, elapsed_time)
-                        return tool_response
-            elif service_type == 'stdio':
-                from mcp.client.stdio import stdio_client, StdioServerParameters
-
-                process_env = os.environ.copy()
-                if 'env' in service:
-                    process_env.update(service['env'])
-
-                cmd = StdioServerParameters(
-                    command=service['command'].split()[0],
-                    args=service['command'].split()[1:],
-                    env=process_env
-                )
-                async with stdio_client(cmd) as streams:
-                    async with ClientSession(streams[0], streams[1]) as session:
-                        await session.initialize()
-
-                        logger.info("Tool %s found in service: %s", tool_name, service['name'])
-                        start_time = time.time()
-                        tool_response = await session.call_tool(tool_name, arguments)
-                        elapsed_time = time.time() - start_time
-                        logger.info("Tool %s executed in %.3f seconds", tool_name, elapsed_time)
-                        return tool_response
-            else:
-                raise ValueError(f"Unsupported service type: {service_type}")
+            return json.loads(arguments)
+        except json.JSONDecodeError:
+            return arguments
+    return arguments
+
+async def run_tool_call(tool_name, arguments, semaphore):
+    """
+    执行单个工具调用，调用失败或超时时以错误信息作为结果。
+    """
+    timeout = context.args.tool_timeout
+    async with semaphore:
+        try:
+            return await asyncio.wait_for(
+                call_tool_with_selected_session(context.registry, tool_name, arguments),
+                timeout)
+        except asyncio.TimeoutError:
+            logger.error("Tool %s timed out after %.1f seconds", tool_name, timeout)
+            return f"Error: tool {tool_name} timed out after {timeout} seconds"
         except Exception as err:
-            logger.error("Failed to call tool %s in service %s: %s", tool_name, service['name'], str(err))
+            logger.error("Tool %s failed: %s", tool_name, str(err))
+            return f"Error: {err}"
 
-    raise ValueError(f"Tool {tool_name} not found in any service")
+class ToolCallDispatcher:
+    """
+    并发执行模型在一轮中返回的工具调用。
 
-async def complete():
+    每个工具调用在dispatch()时即开始执行，同时执行的调用数不超过--max-concurrent-tools，
+    每个调用受--tool-timeout限制；流式输出时工具调用的参数一旦完整即可分发，不必等待整条消息。
     """
-    执行对话并完成任务。
+
+    def __init__(self):
+        self.semaphore = asyncio.Semaphore(context.args.max_concurrent_tools)
+        self.tasks = []
+        self.start_time = None
+
+    def dispatch(self, tool_name, arguments):
+        if self.start_time is None:
+            self.start_time = time.time()
+        logger.info("Dispatching tool call %s", tool_name)
+        self.tasks.append(asyncio.create_task(run_tool_call(tool_name, arguments, self.semaphore)))
+
+    async def results(self):
+        """
+        返回与分发顺序一致的工具调用结果。
+        """
+        tool_results = await asyncio.gather(*self.tasks)
+        if self.tasks:
+            logger.info("%d tool calls executed in %.3f seconds", len(self.tasks), time.time() - self.start_time)
+        return tool_results
+
+class TurnTimer:
     """
-    logger.info("Starting session using %s model", context.args.model_type)
+    记录一轮模型调用的首个token时间和总耗时。
+    """
+
+    def __init__(self):
+        self.start_time = time.time()
+        self.first_token_time = None
+
+    def first_token(self):
+        if self.first_token_time is None:
+            self.first_token_time = time.time()
+            logger.info("Time to first token: %.3f seconds", self.first_token_time - self.start_time)
+
+    def done(self):
+        self.first_token()
+        logger.info("Model turn finished in %.3f seconds", time.time() - self.start_time)
+
+def format_tool_result(tool_result):
+    """
+    将工具调用结果转换为回传给模型的文本，只保留内容部分。
+    """
+    if isinstance(tool_result, str):
+        return tool_result
+    parts = []
+    for item in getattr(tool_result, 'content', None) or []:
+        parts.append(item.text if getattr(item, 'type', None) == 'text' else str(item))
+    text = "\n".join(parts)
+    if getattr(tool_result, 'isError', False):
+        return f"Error: {text}"
+    return text
+
+def message_field(message, key):
+    if isinstance(message, dict):
+        return message.get(key)
+    return getattr(message, key, None)
+
+def estimate_tokens(text):
+    """
+    粗略估算文本的token数：中日韩字符约每字1个token，其他字符约每4个字符1个token。
+    """
+    if not text:
+        return 0
+    cjk = sum(1 for char in text if '\u2e80' <= char <= '\u9fff' or '\uac00' <= char <= '\ud7af')
+    return cjk + (len(text) - cjk + 3) // 4
+
+class ContextWindow:
+    """
+    按token预算管理对话消息。
+
+    每条消息的token数估算一次后缓存；超出预算时，先将较早的工具输出截断为摘要，
+    仍超出时再整轮移除最早的对话，最后移除当前问题中较早的模型调用轮次。
+    系统消息、当前问题和最近几轮模型调用（assistant消息及其工具结果）始终完整保留。
+    """
+
+    def __init__(self, budget, keep_recent_turns=2, tool_summary_chars=500):
+        self.budget = budget
+        self.keep_recent_turns = keep_recent_turns
+        self.tool_summary_chars = tool_summary_chars
+        self._counts = {}
+
+    def tokens(self, message):
+        cached = self._counts.get(id(message))
+        if cached is not None and cached[0] is message and cached[1] == message_field(message, 'content'):
+            return cached[2]
+        content = message_field(message, 'content')
+        count = 4 + estimate_tokens(content if isinstance(content, str) else str(content or ""))
+        tool_calls = message_field(message, 'tool_calls')
+        if tool_calls:
+            count += estimate_tokens(str(tool_calls))
+        self._counts[id(message)] = (message, content, count)
+        return count
+
+    def total(self, messages):
+        return sum(self.tokens(message) for message in messages)
+
+    def _recent_start(self, messages):
+        """
+        返回最近keep_recent_turns轮模型调用（assistant消息及其工具结果）的起始位置。
+        """
+        round_indexes = [i for i, message in enumerate(messages) if message_field(message, 'role') == 'assistant']
+        if self.keep_recent_turns <= 0 or not round_indexes:
+            return len(messages)
+        return round_indexes[-min(self.keep_recent_turns, len(round_indexes))]
+
+    def _remove(self, messages, begin, end):
+        """
+        移除messages[begin:end]，返回移除的估算token数。
+        """
+        removed = 0
+        for message in messages[begin:end]:
+            removed += self.tokens(message)
+            self._counts.pop(id(message), None)
+        del messages[begin:end]
+        return removed
+
+    def compact(self, messages):
+        """
+        就地压缩messages使其不超过预算，返回压缩后的估算token数。
+        """
+        total = self.total(messages)
+        if total <= self.budget:
+            return total
+
+        start = 1 if messages and message_field(messages[0], 'role') == 'system' else 0
+        recent_start = self._recent_start(messages)
+
+        # 1. 截断较早的工具输出，包括当前问题中较早的模型调用轮次
+        for message in messages[start:recent_start]:
+            if total <= self.budget:
+                break
+            content = message_field(message, 'content')
+            if message_field(message, 'role') != 'tool' or not isinstance(content, str) \
+                    or len(content) <= self.tool_summary_chars:
+                continue
+            before = self.tokens(message)
+            message['content'] = (content[:self.tool_summary_chars] +
+                                  f"\n[... {len(content) - self.tool_summary_chars} characters of earlier tool output omitted]")
+            total += self.tokens(message) - before
+
+        # 当前问题（最后一条用户消息）始终保留
+        current_start = start
+        for i in range(start, recent_start):
+            if message_field(messages[i], 'role') == 'user':
+                current_start = i
+
+        # 2. 整轮移除较早的问题及其回答，保证工具调用和工具结果成对移除
+        removed_turns = 0
+        while total > self.budget and start < current_start:
+            end = start + 1
+            while end < current_start and message_field(messages[end], 'role') != 'user':
+                end += 1
+            total -= self._remove(messages, start, end)
+            current_start -= end - start
+            recent_start -= end - start
+            removed_turns += 1
+
+        # 3. 移除当前问题中较早的模型调用轮次（assistant消息及其工具结果）
+        removed_rounds = 0
+        first = current_start + 1 if current_start < recent_start and \
+            message_field(messages[current_start], 'role') == 'user' else current_start
+        while total > self.budget and first < recent_start:
+            end = first + 1
+            while end < recent_start and message_field(messages[end], 'role') != 'assistant':
+                end += 1
+            total -= self._remove(messages, first, end)
+            recent_start -= end - first
+            removed_rounds += 1
+
+        if removed_turns:
+            logger.info("Removed %d earliest turns to fit the context budget", removed_turns)
+        if removed_rounds:
+            logger.info("Removed %d earlier model rounds of the current question to fit the context budget",
+                        removed_rounds)
+        if total > self.budget:
+            logger.warning("Context still exceeds the budget (%d > %d tokens) after compaction", total, self.budget)
+        return total
+
+class ModelProvider:
+    """
+    大模型服务的统一接口，每个provider持有一个复用连接池的异步客户端。
+    """
+
+    display_name = None
+
+    def __init__(self, args):
+        self.model_name = args.model_name
+        # 批量模式下多个对话并发执行，不在终端输出模型回复
+        self.echo = True
+
+    async def complete_turn(self, messages, tools, dispatcher):
+        """
+        以非流式方式完成一轮对话，返回(assistant消息, 工具调用列表)，工具调用已交给dispatcher执行。
+        """
+        raise NotImplementedError
+
+    async def stream_turn(self, messages, tools, dispatcher):
+        """
+        以流式方式完成一轮对话，边接收边输出，工具调用参数完整后立即交给dispatcher执行。
+        """
+        raise NotImplementedError
+
+    def tool_message(self, tool_call, tool_result):
+        """
+        生成回传给模型的工具调用结果消息。
+        """
+        raise NotImplementedError
+
+    async def warm_up(self):
+        """
+        预热模型服务，在获取工具列表的同时执行，缩短第一轮对话的等待时间。
+        """
+        pass
+
+    async def close(self):
+        pass
+
+def environment_proxy(url):
+    """
+    返回访问url时环境变量（HTTP_PROXY/HTTPS_PROXY/NO_PROXY等）指定的代理，不使用代理时返回None。
+
+    httpx客户端指定了transport时不再读取这些环境变量，需要显式传给transport。
+    """
+    parts = urlsplit(url if "://" in url else f"http://{url}")
+    if parts.hostname and urllib.request.proxy_bypass(parts.hostname):
+        return None
+    return urllib.request.getproxies().get(parts.scheme)
+
+class OllamaProvider(ModelProvider):
+
+    display_name = "Ollama"
+
+    def __init__(self, args):
+        super().__init__(args)
+        # 只在使用对应的模型服务时才导入其SDK，缩短启动时间
+        from ollama import AsyncClient
+
+        # 每次请求都带上相同的num_ctx，上下文长度不同时Ollama会重新加载模型
+        self.options = {"num_ctx": args.num_ctx} if args.num_ctx > 0 else None
+        self.keep_alive = args.keep_alive
+        # 连接失败时由httpx的transport负责重试，代理设置仍取自环境变量
+        self.client = AsyncClient(
+            host=args.model_url,
+            timeout=httpx.Timeout(args.model_timeout, connect=10),
+            transport=httpx.AsyncHTTPTransport(
+                retries=args.model_retries,
+                proxy=environment_proxy(args.model_url),
+                limits=httpx.Limits(max_connections=args.model_max_connections,
+                                    max_keepalive_connections=args.model_max_connections)),
+        )
 
+    async def complete_turn(self, messages, tools, dispatcher):
+        timer = TurnTimer()
+        response = await self.client.chat(
+            model=self.model_name,
+            messages=messages,                    
+            tools=tools,
+            options=self.options,
+            keep_alive=self.keep_alive
+        )
+        timer.done()
+        if self.echo:
+            print("Response from Ollama:")
+            print(response.message)
+        #print(response.message.content)
+        tool_calls = []
+        for tool_call in response.message.tool_calls or []:
+            tool_calls.append({"id": None, "name": tool_call.function.name})
+            dispatcher.dispatch(tool_call.function.name, parse_tool_arguments(tool_call.function.arguments))
+        return response['message'], tool_calls
+
+    async def stream_turn(self, messages, tools, dispatcher):
+        timer = TurnTimer()
+        stream = await self.client.chat(
+            model=self.model_name,
+            messages=messages,
+            tools=tools,
+            stream=True,
+            options=self.options,
+            keep_alive=self.keep_alive
+        )
+        content_parts = []
+        tool_calls = []
+        async for chunk in stream:
+            if chunk.message.content:
+                timer.first_token()
+                if self.echo:
+                    print(chunk.message.content, end="", flush=True)
+                content_parts.append(chunk.message.content)
+            # Ollama在一个分片中返回完整的工具调用
+            for tool_call in chunk.message.tool_calls or []:
+                timer.first_token()
+                tool_calls.append(tool_call)
+                dispatcher.dispatch(tool_call.function.name, parse_tool_arguments(tool_call.function.arguments))
+        if self.echo:
+            print()
+        timer.done()
+
+        message = {"role": "assistant", "content": "".join(content_parts)}
+        if tool_calls:
+            message["tool_calls"] = tool_calls
+        return message, [{"id": None, "name": tool_call.function.name} for tool_call in tool_calls]
+
+    def tool_message(self, tool_call, tool_result):
+        return {
+            #"tool_call_id": tool_id,
+            "role": "tool",
+            "name": tool_call["name"],
+            "content": format_tool_result(tool_result)
+        }
+
+    async def warm_up(self):
+        """
+        以空提示加载模型到内存，并使用与对话相同的num_ctx和keep_alive。
+        """
+        await self.client.generate(model=self.model_name, prompt="", options=self.options, keep_alive=self.keep_alive)
+
+    async def close(self):
+        await self.client.close()
+
+class OpenAIProvider(ModelProvider):
+
+    display_name = "OpenAI"
+
+    def __init__(self, args):
+        super().__init__(args)
+        from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+
+        self.client = AsyncOpenAI(
+            base_url=args.model_url,
+            api_key=os.getenv("OPENAI_API_KEY"),
+            timeout=args.model_timeout,
+            max_retries=args.model_retries,
+            http_client=DefaultAsyncHttpxClient(
+                limits=httpx.Limits(max_connections=args.model_max_connections,
+                                    max_keepalive_connections=args.model_max_connections)),
+        )
+
+    async def complete_turn(self, messages, tools, dispatcher):
+        timer = TurnTimer()
+        response = await self.client.chat.completions.create(
+            model=self.model_name,
+            messages=messages,
+            tools=tools
+        )
+        timer.done()
+        if self.echo:
+            print("Response from OpenAI:")
+            print(response.choices[0].message.content)
+        tool_calls = []
+        for tool_call in response.choices[0].message.tool_calls or []:
+            tool_calls.append({"id": tool_call.id, "name": tool_call.function.name})
+            dispatcher.dispatch(tool_call.function.name, parse_tool_arguments(tool_call.function.arguments))
+        return response.choices[0].message, tool_calls
+
+    async def stream_turn(self, messages, tools, dispatcher):
+        """
+        增量拼接工具调用的参数，当后一个工具调用开始或响应结束时，前一个工具调用的参数即已完整，随即分发执行。
+        """
+        timer = TurnTimer()
+        stream = await self.client.chat.completions.create(
+            model=self.model_name,
+            messages=messages,
+            tools=tools,
+            stream=True
+        )
+        content_parts = []
+        pending = {}
+        tool_calls = []
+
+        def flush(index):
+            call = pending.pop(index)
+            tool_calls.append(call)
+            dispatcher.dispatch(call["name"], parse_tool_arguments(call["arguments"]))
+
+        async for chunk in stream:
+            if not chunk.choices:
+                continue
+            choice = chunk.choices[0]
+            delta = choice.delta
+            if delta.content:
+                timer.first_token()
+                if self.echo:
+                    print(delta.content, end="", flush=True)
+                content_parts.append(delta.content)
+            for tool_call_delta in delta.tool_calls or []:
+                timer.first_token()
+                for index in sorted(index for index in pending if index < tool_call_delta.index):
+                    flush(index)
+                call = pending.setdefault(tool_call_delta.index, {"id": None, "name": "", "arguments": ""})
+                if tool_call_delta.id:
+                    call["id"] = tool_call_delta.id
+                if tool_call_delta.function:
+                    call["name"] += tool_call_delta.function.name or ""
+                    call["arguments"] += tool_call_delta.function.arguments or ""
+            if choice.finish_reason:
+                for index in sorted(pending):
+                    flush(index)
+        for index in sorted(pending):
+            flush(index)
+        if self.echo:
+            print()
+        timer.done()
+
+        message = {"role": "assistant", "content": "".join(content_parts) or None}
+        if tool_calls:
+            message["tool_calls"] = [{
+                "id": call["id"],
+                "type": "function",
+                "function": {"name": call["name"], "arguments": call["arguments"]}} for call in tool_calls]
+        return message, tool_calls
+
+    def tool_message(self, tool_call, tool_result):
+        return {
+            "tool_call_id": tool_call["id"],
+            "role": "tool",
+            "name": tool_call["name"],
+            "content": format_tool_result(tool_result)
+        }
+
+    async def warm_up(self):
+        """
+        建立到模型服务的连接；服务不支持列出模型时请求会失败，但连接已建立并保留在连接池中。
+        """
+        try:
+            await self.client.models.list()
+        except Exception as err:
+            logger.info("Warm-up request failed (%s), the connection is open", str(err))
+
+    async def close(self):
+        await self.client.close()
+
+def create_model_provider(args):
+    """
+    根据--model-type创建大模型服务的provider。
+    """
+    model_type = args.model_type.lower()
+    if model_type == "ollama":
+        return OllamaProvider(args)
+    elif model_type == "openai":
+        return OpenAIProvider(args)
+    raise ValueError(f"Unsupported model type: {args.model_type}")
+
+def create_context_window(args):
+    """
+    根据--context-budget创建对话的上下文窗口，预算为0时不限制。
+    """
+    if args.context_budget > 0:
+        return ContextWindow(args.context_budget, args.keep_recent_turns, args.tool_summary_chars)
+    return None
+
+async def complete(conversation):
+    """
+    执行对话并完成任务。
+
+    参数：
+        conversation (Conversation): 要执行的对话；交互式对话在模型回复后等待用户输入，
+            非交互式对话在模型不再调用工具时结束
+    """
     try:
-        converted_tools = None
-        if context.with_tools:
-            converted_tools = convert_tool_format(context.combined_tools)
         # 与大模型服务交互
-        if context.args.model_type.lower() == "ollama":
-            client = Client(host=context.args.model_url)
-            while True:
-                print("Messages:", context.messages)
-                response: ChatResponse = client.chat(
-                    model=context.args.model_name,
-                    messages=context.messages,                    
-                    tools=converted_tools
-                )
-                print("Response from Ollama:")
-                print(response.message)
-                #print(response.message.content)
-                context.messages.append(response['message'])
-
-                if response.message.tool_calls:
-                    for tool_call in response.message.tool_calls:
-                        tool_name = tool_call.function.name
-                        #tool_id = tool_call.id
-                        # 如果arguments是字符串，则需要解析为字典
-                        if isinstance(tool_call.function.arguments, str):
-                            try:
-                                arguments = json.loads(tool_call.function.arguments)
-                            except json.JSONDecodeError:
-                                arguments = tool_call.function.arguments
-                        else:
-                            arguments = tool_call.function.arguments
-                        tool_result = await call_tool_with_selected_session(context.services, context.combined_tools, tool_name, arguments)
-                        context.messages.append({
-                            #"tool_call_id": tool_id,
-                            "role": "tool",
-                            "name": tool_name,
-                            "content": str({"toolResult": tool_result})
-                        })
-                else:
-                    user_input, exit_chat = handle_input()
-                    if exit_chat:
-                        print("退出对话")
-                        break
-
-        elif context.args.model_type.lower() == "openai":
-            openai_client = OpenAI(base_url=context.args.model_url, api_key=os.getenv("OPENAI_API_KEY"))
-            while True:
-                print("Messages:", context.messages)
-                response = openai_client.chat.completions.create(
-                    model=context.args.model_name,
-                    messages=context.messages,
-                    tools=converted_tools
-                )
-                print("Response from OpenAI:")
-                print(response.choices[0].message.content)
-                context.messages.append(response.choices[0].message)
-
-                if response.choices[0].message.tool_calls:
-                    for tool_call in response.choices[0].message.tool_calls:
-                        tool_name = tool_call.function.name
-                        tool_id = tool_call.id
-                        # 如果arguments是字符串，则需要解析为字典
-                        if isinstance(tool_call.function.arguments, str):
-                            try:
-                                arguments = json.loads(tool_call.function.arguments)
-                            except json.JSONDecodeError:
-                                arguments = tool_call.function.arguments
-                        else:
-                            arguments = tool_call.function.arguments
-                        tool_result = await call_tool_with_selected_session(context.services, context.combined_tools, tool_name, arguments)
-                        context.messages.append({
-                            "tool_call_id": tool_id,
-                            "role": "tool",
-                            "name": tool_name,
-                            "content": str(tool_result)
-                        })
-                else:
-                    user_input, exit_chat = handle_input()
-                    if exit_chat:
-                        print("退出对话")
-                        break
-        else:
-            raise ValueError(f"Unsupported model type: {context.args.model_type}")
+        provider = context.provider
+        while True:
+            if conversation.interactive:
+                print("Messages:", conversation.messages)
+            if conversation.window:
+                total_tokens = conversation.window.compact(conversation.messages)
+                logger.info("Context: %d messages, ~%d tokens", len(conversation.messages), total_tokens)
+            dispatcher = ToolCallDispatcher()
+            tools = context.registry.converted_tools or None
+            turn_start = time.time()
+            if context.args.stream:
+                if provider.echo:
+                    print(f"Response from {provider.display_name}:")
+                message, tool_calls = await provider.stream_turn(conversation.messages, tools, dispatcher)
+            else:
+                message, tool_calls = await provider.complete_turn(conversation.messages, tools, dispatcher)
+            conversation.model_seconds += time.time() - turn_start
+            conversation.turns += 1
+            if conversation.turns == 1 and conversation.interactive:
+                logger.info("First model turn finished in %.3f seconds", conversation.model_seconds)
+            conversation.messages.append(message)
+
+            if tool_calls:
+                tool_start = time.time()
+                tool_results = await dispatcher.results()
+                conversation.tool_seconds += time.time() - tool_start
+                conversation.tool_calls += len(tool_calls)
+                for tool_call, tool_result in zip(tool_calls, tool_results):
+                    conversation.messages.append(provider.tool_message(tool_call, tool_result))
+                if 0 < conversation.max_turns <= conversation.turns:
+                    raise RuntimeError(f"Conversation exceeded {conversation.max_turns} model turns")
+            elif conversation.interactive:
+                user_input, exit_chat = await read_in_daemon_thread(handle_input)
+                if exit_chat:
+                    print("退出对话")
+                    break
+            else:
+                break
     except Exception as err:
         logger.error("Error during conversation: %s", str(err))
         raise
 
+def parse_batch_line(line):
+    """
+    解析批量输入中的一行。
+
+    每行为一个JSON对象，问题取自query字段，没有时取自title和body字段（兼容requests.jsonl），
+    编号取自id或request_id字段；不是JSON对象的行整行作为问题。
+
+    返回：
+        tuple: (编号, 问题)，空行返回(None, None)
+    """
+    line = line.strip()
+    if not line:
+        return None, None
+    try:
+        item = json.loads(line)
+    except json.JSONDecodeError:
+        return None, line
+    if not isinstance(item, dict):
+        return None, str(item)
+    query = item.get("query")
+    if not query:
+        query = "\n\n".join(str(item[key]) for key in ("title", "body") if item.get(key))
+    return item.get("id", item.get("request_id")), query
+
+async def run_batch_query(index, query_id, query):
+    """
+    在独立的对话中执行一个批量查询。
+
+    返回：
+        dict: 写入结果文件的记录，包含回答、状态和耗时
+    """
+    conversation = Conversation(
+        messages=[context.system_message, {"role": "user", "content": query}],
+        window=create_context_window(context.args),
+        interactive=False,
+        max_turns=context.args.batch_max_turns,
+    )
+    record = {"index": index, "id": query_id, "query": query}
+    started_at = datetime.datetime.now()
+    start_time = time.time()
+    try:
+        await complete(conversation)
+        record["status"] = "ok"
+        record["answer"] = message_field(conversation.messages[-1], 'content')
+    except Exception as err:
+        record["status"] = "error"
+        record["error"] = str(err) or type(err).__name__
+    record.update({
+        "turns": conversation.turns,
+        "tool_calls": conversation.tool_calls,
+        "started_at": started_at.isoformat(timespec='milliseconds'),
+        "duration": round(time.time() - start_time, 3),
+        "model_seconds": round(conversation.model_seconds, 3),
+        "tool_seconds": round(conversation.tool_seconds, 3),
+    })
+    logger.info("Query %s finished (%s) in %.3f seconds", query_id if query_id is not None else index,
+                record["status"], record["duration"])
+    return record
+
+async def run_batch(input_file, output_file, concurrency):
+    """
+    批量执行input_file中的查询，最多concurrency个对话并发执行，结果按完成顺序逐行写入output_file。
+
+    参数：
+        input_file (str): JSONL格式的输入文件，为"-"时从标准输入读取
+        output_file (str): JSONL格式的结果文件
+        concurrency (int): 并发执行的对话数
+    """
+    concurrency = max(1, concurrency)
+    context.provider.echo = False
+    # 队列有界，输入文件很大时也只按需读取
+    queue = asyncio.Queue(maxsize=concurrency * 2)
+    counts = {"ok": 0, "error": 0}
+    source = sys.stdin if input_file == "-" else open(input_file, 'r', encoding='utf-8')
+    # 从标准输入读取时可能一直阻塞，使用守护线程，不影响Ctrl-C退出
+    read = read_in_daemon_thread if source is sys.stdin else asyncio.to_thread
+    start_time = time.time()
+
+    async def produce():
+        try:
+            index = 0
+            while True:
+                line = await read(source.readline)
+                if not line:
+                    break
+                index += 1
+                query_id, query = parse_batch_line(line)
+                if query:
+                    await queue.put((index, query_id, query))
+        finally:
+            for _ in range(concurrency):
+                await queue.put(None)
+
+    async def work(output):
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            record = await run_batch_query(*item)
+            counts[record["status"]] += 1
+            output.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+            output.flush()
+
+    try:
+        with open(output_file, 'w', encoding='utf-8') as output:
+            await asyncio.gather(produce(), *(work(output) for _ in range(concurrency)))
+    finally:
+        if source is not sys.stdin:
+            source.close()
+
+    duration = time.time() - start_time
+    total = counts["ok"] + counts["error"]
+    logger.info("Batch finished: %d queries (%d failed) in %.3f seconds, %.1f queries/hour, results in %s",
+                total, counts["error"], duration, total * 3600 / duration if duration > 0 else 0, output_file)
+
+def positive_int(value):
+    """
+    argparse的参数类型：不小于1的整数。
+    """
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {value}")
+    return number
+
 async def main():
     parser = argparse.ArgumentParser(description='运行MCP客户端')
     parser.add_argument('-t', '--model-type', type=str, choices=['openai', 'ollama'], default=model_type,
@@ -404,16 +1591,92 @@ async def main():
                         help='指定加载的MCP服务名称，默认为None加载所有服务')
     parser.add_argument('-q', '--query', type=str, default=start_query,
                         help='要询问的问题')
+    parser.add_argument('--tools-cache', type=str, default=tools_cache_file,
+                        help='工具列表缓存文件路径，为空时不使用缓存')
+    parser.add_argument('--tool-result-cache', type=str, default=tool_result_cache_file,
+                        help='工具调用结果的持久化缓存文件(SQLite)，可由多个批量运行共享，为空时只缓存在内存中')
+    parser.add_argument('--tool-result-ttl', type=float, default=tool_result_ttl,
+                        help='toolCache中未指定ttl的工具结果的有效期（秒）')
+    parser.add_argument('--tools-cache-ttl', type=float, default=tools_cache_ttl,
+                        help='工具列表缓存的有效期（秒），过期后在后台重新获取')
+    parser.add_argument('--model-timeout', type=float, default=model_timeout,
+                        help='单次模型调用的超时时间（秒）')
+    parser.add_argument('--model-retries', type=int, default=model_retries,
+                        help='模型调用失败时的重试次数')
+    parser.add_argument('--model-max-connections', type=int, default=model_max_connections,
+                        help='到模型服务的连接池大小')
+    parser.add_argument('--context-budget', type=int, default=context_budget,
+                        help='发送给模型的对话消息的token预算（估算值），为0时不限制')
+    parser.add_argument('--keep-recent-turns', type=int, default=keep_recent_turns,
+                        help='压缩上下文时完整保留的最近模型调用轮数（assistant消息及其工具结果）')
+    parser.add_argument('--tool-summary-chars', type=int, default=tool_summary_chars,
+                        help='压缩上下文时较早的工具输出保留的字符数')
+    parser.add_argument('--stream', action='store_true',
+                        help='以流式方式接收模型输出，边生成边显示，工具调用参数完整后立即执行')
+    parser.add_argument('--max-concurrent-tools', type=positive_int, default=max_concurrent_tools,
+                        help='同一轮中并发执行的工具调用数上限，不小于1')
+    parser.add_argument('--tool-timeout', type=float, default=tool_timeout,
+                        help='单个工具调用的超时时间（秒）')
+    parser.add_argument('--watch-config', type=float, default=watch_config_interval,
+                        help='检查配置文件变化的间隔（秒），文件变化时增量加载服务，为0时不检查')
+    parser.add_argument('--discovery-timeout', type=float, default=discovery_timeout,
+                        help='单个服务获取工具列表的超时时间（秒）')
+    parser.add_argument('--warm-up', action='store_true',
+                        help='获取工具列表的同时预热模型服务：Ollama预先加载模型，OpenAI预先建立连接')
+    parser.add_argument('--keep-alive', type=str, default=ollama_keep_alive,
+                        help='Ollama模型在内存中的保留时间，如30m，默认使用Ollama的设置')
+    parser.add_argument('--num-ctx', type=int, default=ollama_num_ctx,
+                        help='Ollama模型的上下文长度，预热和对话使用相同的值，为0时使用模型的默认值')
+    parser.add_argument('-b', '--batch', type=str, default=None,
+                        help='批量模式：从JSONL文件读取查询并发执行，为"-"时从标准输入读取')
+    parser.add_argument('-o', '--batch-output', type=str, default=batch_output,
+                        help='批量模式的结果文件（JSONL），每个查询一行，包含回答和耗时')
+    parser.add_argument('--batch-concurrency', type=int, default=batch_concurrency,
+                        help='批量模式下并发执行的对话数')
+    parser.add_argument('--batch-max-turns', type=int, default=batch_max_turns,
+                        help='批量模式下单个对话的模型调用轮数上限，为0时不限制')
 
     context.args = parser.parse_args()
     print("命令行参数:", context.args)
 
+    try:
+        await run()
+    finally:
+        for task in list(context.background_tasks):
+            task.cancel()
+        await asyncio.gather(*context.background_tasks, return_exceptions=True)
+        if context.session_manager:
+            await context.session_manager.close()
+        if context.tool_result_cache:
+            context.tool_result_cache.close()
+        if context.provider:
+            await context.provider.close()
+
+async def warm_up_provider():
+    start_time = time.time()
+    try:
+        await context.provider.warm_up()
+        logger.info("Model %s warmed up in %.3f seconds", context.args.model_name, time.time() - start_time)
+    except Exception as err:
+        logger.warning("Failed to warm up model %s: %s", context.args.model_name, str(err))
+
+async def run():
+    context.provider = create_model_provider(context.args)
+    if context.args.warm_up:
+        # 预热与获取工具列表同时进行，不阻塞用户输入
+        track_task(asyncio.create_task(warm_up_provider()))
     context.system_message = await format_system_promt()
+    logger.info("Client ready after %.3f seconds", time.time() - client_start_time)
+    if context.args.batch:
+        await run_batch(context.args.batch, context.args.batch_output, context.args.batch_concurrency)
+        return
+
     context.messages.append(context.system_message)
 
     # 未指定query或者query内容为空时，提示用户输入查询的问题
     if not context.args.query:
-        context.args.query, exit_chat = handle_input("请输入要询问的问题: ")
+        # 在线程中等待输入，使后台的预热、工具列表重新验证等任务继续执行
+        context.args.query, exit_chat = await read_in_daemon_thread(handle_input, "请输入要询问的问题: ")
         if exit_chat:
             print("退出对话")
             return
@@ -429,7 +1692,8 @@ async def main():
                 start_time.strftime("%Y-%m-%d %H:%M:%S"), 
                 start_time.microsecond // 1000)
 
-    await complete()
+    logger.info("Starting session using %s model", context.args.model_type)
+    await complete(Conversation(context.messages, create_context_window(context.args)))
 
     end_time = datetime.datetime.now()
     duration = (end_time - start_time).total_seconds()
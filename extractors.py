@@ -0,0 +1,236 @@
+import re
+import time
+
+import html2text
+import lxml.html
+from readability import Document
+
+
+class Extractor:
+    """
+    正文提取引擎的接口：从HTML中提取正文并转换为Markdown。
+
+    extract()在工作进程中执行，返回(Markdown, 各环节耗时)，耗时以{环节名: 秒}表示，随结果返回给服务器进程。
+    """
+
+    name = None
+
+    def extract(self, html):
+        raise NotImplementedError
+
+class ReadabilityExtractor(Extractor):
+    """
+    默认引擎：readability提取正文，html2text转换为Markdown，再移除空行。
+    """
+
+    name = "readability"
+
+    def extract(self, html):
+        # 2. 提取正文
+        start_time = time.perf_counter()
+        doc = Document(html)
+        clean_html = doc.summary()  # 获取清理后的正文HTML
+        readability_time = time.perf_counter() - start_time
+
+        # 3. 转换为Markdown
+        h = html2text.HTML2Text()
+        h.single_line_break = True   # 单换行转为<br>
+        h.wrap_links = False        # 不换行长链接
+        h.mark_code = True          # 高亮代码块
+        h.ignore_links = False      # 保留链接
+        h.ignore_images = False     # 保留图片
+
+        markdown = h.handle(clean_html)
+        # 移除多余空行
+        markdown = "\n".join([line for line in markdown.split("\n") if line.strip()])
+        return markdown, {"readability": readability_time,
+                          "html2text": time.perf_counter() - start_time - readability_time}
+
+class LxmlExtractor(Extractor):
+    """
+    快速引擎：lxml只解析一次文档，按标签和class/id跳过导航、页脚等非正文部分，
+    优先选择<article>/<main>作为正文，遍历一次即写出Markdown。
+
+    不做readability的逐段评分，对结构不规范的页面去除噪声的效果较差，但在大页面上快得多。
+    """
+
+    name = "lxml"
+
+    skip_tags = {"script", "style", "noscript", "nav", "footer", "aside", "form", "iframe",
+                 "svg", "button", "select", "template", "head", "title", "meta", "link"}
+    block_tags = {"p", "div", "section", "article", "main", "figure", "figcaption", "dl", "dt", "dd",
+                  "address", "details", "summary", "body", "html", "center"}
+    boilerplate = re.compile(r"(^|[-_ ])(comments?|sidebar|footer|nav|navbar|menu|breadcrumbs?|share|social|"
+                             r"advert|ads?|cookie|related|promo|popup|banner|masthead)($|[-_ ])", re.IGNORECASE)
+    whitespace = re.compile(r"\s+")
+    max_depth = 200
+
+    def extract(self, html):
+        start_time = time.perf_counter()
+        # 与readability一样按UTF-8字节解析，文本以<?xml encoding=...?>开头（常见于XHTML）时lxml不接受str；
+        # 解析失败时抛出异常，不把空文档当作成功的结果
+        parser = lxml.html.HTMLParser(encoding="utf-8")
+        root = lxml.html.document_fromstring(html.encode("utf-8"), parser=parser)
+        parse_time = time.perf_counter() - start_time
+
+        writer = MarkdownWriter(self)
+        writer.element(self.content_root(root), 0)
+        writer.flush()
+        return "\n".join(writer.lines), {"parse": parse_time, "markdown": time.perf_counter() - start_time - parse_time}
+
+    def content_root(self, root):
+        candidates = root.xpath("//article|//main|//*[@role='main']")
+        if candidates:
+            return max(candidates, key=lambda element: len(element.text_content()))
+        body = root.find("body")
+        return body if body is not None else root
+
+    def skipped(self, element):
+        if element.tag in self.skip_tags:
+            return True
+        # 只跳过页面级的<header>，<article>/<main>/<section>中的<header>通常包含正文标题
+        if element.tag == "header" and next(element.iterancestors("article", "main", "section"), None) is None:
+            return True
+        names = (element.get("class") or "") + " " + (element.get("id") or "")
+        return names.strip() != "" and self.boilerplate.search(names) is not None
+
+class MarkdownWriter:
+    """
+    LxmlExtractor使用的单遍Markdown写出器，行内文本累积到当前行，块级元素开始和结束时换行。
+    """
+
+    def __init__(self, extractor):
+        self.extractor = extractor
+        self.lines = []
+        self.inline = []
+        self.prefix = ""
+
+    def text(self, text):
+        if text:
+            text = self.extractor.whitespace.sub(" ", text)
+            if text != " " or (self.inline and not self.inline[-1].endswith(" ")):
+                self.inline.append(text)
+
+    def flush(self):
+        line = "".join(self.inline).strip()
+        self.inline = []
+        if line:
+            self.lines.append(self.prefix + line)
+
+    def children(self, element, depth):
+        self.text(element.text)
+        for child in element:
+            self.element(child, depth + 1)
+            self.text(child.tail)
+
+    def element(self, element, depth):
+        tag = element.tag
+        if not isinstance(tag, str) or self.extractor.skipped(element):
+            return
+        if depth > self.extractor.max_depth:
+            self.text(element.text_content())
+            return
+
+        if tag in ("h1", "h2", "h3", "h4", "h5", "h6"):
+            self.flush()
+            self.inline.append("#" * int(tag[1]) + " ")
+            self.children(element, depth)
+            self.flush()
+        elif tag == "br":
+            self.flush()
+        elif tag == "hr":
+            self.flush()
+            self.lines.append("* * *")
+        elif tag == "a":
+            href = element.get("href")
+            start = len(self.inline)
+            self.children(element, depth)
+            label = "".join(self.inline[start:]).strip()
+            del self.inline[start:]
+            if label and href and not href.startswith(("#", "javascript:")):
+                self.inline.append(f"[{label}]({href})")
+            elif label:
+                self.inline.append(label)
+        elif tag == "img":
+            src = element.get("src")
+            if src:
+                self.inline.append(f"![{(element.get('alt') or '').strip()}]({src})")
+        elif tag in ("strong", "b", "em", "i", "code"):
+            mark = {"strong": "**", "b": "**", "em": "_", "i": "_", "code": "`"}[tag]
+            start = len(self.inline)
+            self.children(element, depth)
+            content = "".join(self.inline[start:]).strip()
+            del self.inline[start:]
+            if content:
+                self.inline.append(f"{mark}{content}{mark}")
+        elif tag == "pre":
+            self.flush()
+            self.lines.append(self.prefix + "```")
+            self.lines.extend(self.prefix + line for line in element.text_content().splitlines() if line.strip())
+            self.lines.append(self.prefix + "```")
+        elif tag in ("ul", "ol"):
+            self.flush()
+            number = 0
+            for child in element:
+                if child.tag != "li" or self.extractor.skipped(child):
+                    continue
+                number += 1
+                marker = f"{number}. " if tag == "ol" else "* "
+                outer = self.prefix
+                first = len(self.lines)
+                # 列表项的后续行（如嵌套列表）缩进，第一行与标记对齐到外层
+                self.prefix = outer + "  "
+                self.inline.append(marker)
+                self.children(child, depth + 1)
+                self.flush()
+                self.prefix = outer
+                if len(self.lines) > first and self.lines[first].startswith(outer + "  " + marker):
+                    self.lines[first] = outer + self.lines[first][len(outer) + 2:]
+        elif tag == "blockquote":
+            self.flush()
+            outer = self.prefix
+            self.prefix = outer + "> "
+            self.children(element, depth)
+            self.flush()
+            self.prefix = outer
+        elif tag == "table":
+            self.flush()
+            self.table(element, depth)
+        elif tag in self.extractor.block_tags or tag == "li":
+            self.flush()
+            self.children(element, depth)
+            self.flush()
+        else:
+            self.children(element, depth)
+
+    def table(self, element, depth):
+        rows = []
+        for row in element.iter("tr"):
+            cells = []
+            for cell in row:
+                if cell.tag not in ("td", "th"):
+                    continue
+                writer = MarkdownWriter(self.extractor)
+                writer.children(cell, depth + 1)
+                writer.flush()
+                cells.append(" ".join(writer.lines).replace("|", "\\|"))
+            if cells:
+                rows.append(cells)
+        for index, cells in enumerate(rows):
+            self.lines.append(self.prefix + "| " + " | ".join(cells) + " |")
+            if index == 0:
+                self.lines.append(self.prefix + "|" + "---|" * len(cells))
+
+extractors = {extractor.name: extractor for extractor in (ReadabilityExtractor(), LxmlExtractor())}
+
+def extract_markdown(html, engine="readability"):
+    """
+    使用指定的引擎从HTML中提取正文并转换为Markdown。
+
+    返回：
+        tuple: (Markdown, {环节名: 耗时})
+    """
+    extractor = extractors.get(engine)
+    if extractor is None:
+        raise ValueError(f"Unknown extractor '{engine}', available: {', '.join(extractors)}")
+    return extractor.extract(html)
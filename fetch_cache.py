@@ -0,0 +1,255 @@
+import asyncio
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field
+
+
+@dataclass
+class CacheEntry:
+    url: str
+    raw: str
+    markdown: str
+    etag: str = None
+    last_modified: str = None
+    stored_at: float = field(default_factory=time.time)
+    expires_at: float = 0
+
+    @property
+    def size(self):
+        return len(self.raw) + len(self.markdown)
+
+    @property
+    def fresh(self):
+        return time.time() < self.expires_at
+
+    def conditional_headers(self):
+        """
+        返回重新验证时使用的条件请求头。
+        """
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+
+def parse_cache_control(headers, default_ttl):
+    """
+    根据Cache-Control计算缓存的有效期（秒）。
+
+    返回：
+        float: 有效期，响应不允许缓存时返回None
+    """
+    directives = {}
+    for item in headers.get("cache-control", "").split(","):
+        key, _, value = item.strip().partition("=")
+        if key:
+            directives[key.lower()] = value.strip('"')
+
+    if "no-store" in directives or "private" in directives:
+        return None
+    if "no-cache" in directives:
+        return 0
+    for key in ("s-maxage", "max-age"):
+        if key in directives:
+            try:
+                return max(0, int(directives[key]))
+            except ValueError:
+                pass
+    return default_ttl
+
+
+class FetchCache:
+    """
+    fetch工具的响应缓存，保存原始响应和提取后的Markdown。
+
+    内存中为LRU缓存，按条目数和总大小淘汰；配置了cache_dir时同时写入磁盘，
+    内存未命中时从磁盘加载。超过max_age的条目无论是否可以重新验证都会被淘汰。
+
+    磁盘读写和目录清理在单独的线程中执行，不阻塞事件循环；写入在后台进行，close()时等待完成。
+    get()时未过期的条目计为命中，没有或已过期的条目计为未命中，过期条目重新验证成功时另计revalidations。
+    """
+
+    def __init__(self, max_entries=1000, max_bytes=256 * 1024 * 1024, default_ttl=300,
+                 max_age=86400, cache_dir=None, max_disk_bytes=1024 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.default_ttl = default_ttl
+        self.max_age = max_age
+        self.cache_dir = cache_dir
+        self.max_disk_bytes = max_disk_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+        self.evictions = 0
+        self._disk_writes = 0
+        self._disk = None
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def stats(self):
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "revalidations": self.revalidations,
+            "evictions": self.evictions,
+        }
+
+    async def get(self, url):
+        """
+        返回url对应的缓存条目（可能已过期，需要重新验证），没有时返回None。
+        """
+        entry = self._entries.get(url)
+        if entry is None and self.cache_dir:
+            entry = await asyncio.get_running_loop().run_in_executor(self._disk_executor(), self._load, url)
+            if entry is not None:
+                self._store_memory(entry)
+        if entry is not None and time.time() - entry.stored_at > self.max_age:
+            self.remove(url)
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return None
+        if url in self._entries:
+            self._entries.move_to_end(url)
+        if entry.fresh:
+            self.hits += 1
+        else:
+            self.misses += 1
+        return entry
+
+    def put(self, url, raw, markdown, headers):
+        """
+        根据响应头保存缓存条目，响应不允许缓存时返回None。
+        """
+        ttl = parse_cache_control(headers, self.default_ttl)
+        if ttl is None:
+            self.remove(url)
+            return None
+        entry = CacheEntry(
+            url=url,
+            raw=raw,
+            markdown=markdown,
+            etag=headers.get("etag"),
+            last_modified=headers.get("last-modified"),
+            expires_at=time.time() + ttl,
+        )
+        self._store_memory(entry)
+        self._save_in_background(entry)
+        return entry
+
+    def refresh(self, entry, headers):
+        """
+        收到304 Not Modified后更新条目的有效期。
+        """
+        ttl = parse_cache_control(headers, self.default_ttl)
+        entry.stored_at = time.time()
+        entry.expires_at = entry.stored_at + (ttl or 0)
+        entry.etag = headers.get("etag", entry.etag)
+        entry.last_modified = headers.get("last-modified", entry.last_modified)
+        self.revalidations += 1
+        self._save_in_background(entry)
+        return entry
+
+    def remove(self, url):
+        entry = self._entries.pop(url, None)
+        if entry is not None:
+            self._bytes -= entry.size
+        if self.cache_dir:
+            self._disk_executor().submit(self._remove_file, self._path(url))
+
+    def close(self):
+        """
+        等待后台的磁盘写入完成。
+        """
+        if self._disk is not None:
+            self._disk.shutdown(wait=True)
+            self._disk = None
+
+    def _disk_executor(self):
+        # 单个线程依次执行磁盘操作，同一条目的写入和删除保持顺序
+        if self._disk is None:
+            self._disk = ThreadPoolExecutor(max_workers=1, thread_name_prefix="fetch-cache-disk")
+        return self._disk
+
+    def _save_in_background(self, entry):
+        if self.cache_dir:
+            # 在提交时复制条目的内容，之后refresh()修改条目不影响正在写入的数据
+            self._disk_executor().submit(self._save, entry.url, asdict(entry))
+
+    @staticmethod
+    def _remove_file(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def _store_memory(self, entry):
+        old = self._entries.pop(entry.url, None)
+        if old is not None:
+            self._bytes -= old.size
+        self._entries[entry.url] = entry
+        self._bytes += entry.size
+        while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= evicted.size
+            self.evictions += 1
+
+    def _path(self, url):
+        return os.path.join(self.cache_dir, hashlib.sha256(url.encode("utf-8")).hexdigest() + ".json")
+
+    def _load(self, url):
+        try:
+            with open(self._path(url), "r", encoding="utf-8") as f:
+                return CacheEntry(**json.load(f))
+        except (OSError, ValueError, TypeError):
+            return None
+
+    def _save(self, url, data):
+        path = self._path(url)
+        tmp_path = path + ".tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except OSError as err:
+            print(f"Failed to write fetch cache entry {path}: {err}")
+            return
+        # 扫描目录的代价较高，每写入一定次数才检查一次磁盘占用
+        self._disk_writes += 1
+        if self._disk_writes % 100 == 1:
+            self._evict_disk()
+
+    def _evict_disk(self):
+        files = []
+        total = 0
+        now = time.time()
+        for item in os.scandir(self.cache_dir):
+            if not item.name.endswith(".json"):
+                continue
+            try:
+                stat = item.stat()
+                if now - stat.st_mtime > self.max_age:
+                    os.remove(item.path)
+                    continue
+            except OSError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, item.path))
+            total += stat.st_size
+        for _, size, path in sorted(files):
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
@@ -0,0 +1,131 @@
+import bisect
+import math
+
+# 默认的直方图分桶（秒），覆盖从毫秒级的缓存命中到几十秒的慢页面
+default_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+def format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+def format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+class Metric:
+    """
+    指标的基类，按标签值分别记录。
+
+    标签值按labelnames的顺序以位置参数传入；更新只涉及字典查找和加法，
+    服务器是单线程的事件循环，不需要加锁。
+    """
+
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+
+    def samples(self):
+        for labels, value in self._values.items():
+            yield self.name, labels, None, value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for name, labels, extra, value in self.samples():
+            lines.append(f"{name}{format_labels(self.labelnames, labels, extra)} {format_value(value)}")
+        return lines
+
+class Counter(Metric):
+
+    kind = "counter"
+
+    def inc(self, *labels, amount=1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+class Gauge(Metric):
+
+    kind = "gauge"
+
+    def __init__(self, name, documentation, labelnames=(), function=None):
+        super().__init__(name, documentation, labelnames)
+        self.function = function
+
+    def set(self, value, *labels):
+        self._values[labels] = value
+
+    def inc(self, *labels, amount=1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def dec(self, *labels, amount=1):
+        self._values[labels] = self._values.get(labels, 0) - amount
+
+    def samples(self):
+        if self.function is not None:
+            # 由回调在抓取时计算的指标，如缓存大小
+            yield self.name, (), None, self.function()
+        else:
+            yield from super().samples()
+
+class Histogram(Metric):
+
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=default_buckets):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, *labels):
+        state = self._values.get(labels)
+        if state is None:
+            # 每个分桶的计数（非累计），最后一个为+Inf，以及总和
+            state = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        state[0][bisect.bisect_left(self.buckets, value)] += 1
+        state[1] += value
+
+    def samples(self):
+        for labels, (counts, total) in self._values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                yield self.name + "_bucket", labels, ("le", format_value(float(bound))), cumulative
+            yield self.name + "_sum", labels, None, total
+            yield self.name + "_count", labels, None, cumulative
+
+class MetricsRegistry:
+    """
+    进程内的指标集合，render()输出Prometheus文本格式。
+    """
+
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=(), function=None):
+        return self.register(Gauge(name, documentation, labelnames, function))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=default_buckets):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
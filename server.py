@@ -2,88 +2,677 @@ import mcp.types as types
 
 from mcp import Tool
 from mcp.server.sse import SseServerTransport
+from mcp.server.stdio import stdio_server
+from mcp.server.streamable_http_manager import StreamableHTTPSessionManager
 from mcp.server import Server
 from mcp.server import Server
 
 from starlette.applications import Starlette
-from starlette.routing import Route
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Mount, Route
 
 import uvicorn
 import httpx
+import anyio
 
-from readability import Document
-import html2text
+from admission import AdmissionController, Overloaded
+from extractors import extract_markdown, extractors
+from fetch_cache import FetchCache
+from metrics import MetricsRegistry
 
+import argparse
+import asyncio
+import codecs
+import multiprocessing
 import os 
-
-os.environ['HTTP_PROXY'] = 'http://192.168.16.248:7890'
-os.environ['HTTPS_PROXY'] = 'http://192.168.16.248:7890'
+import re
+import signal
+import socket
+import sys
+import tempfile
+import time
+from collections import OrderedDict
+from concurrent.futures import BrokenExecutor, ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import AsyncExitStack, asynccontextmanager
+from io import TextIOWrapper
+from urllib.parse import urlsplit
 
 app = Server("mcp-server")
-sse = SseServerTransport("/messages")
+sse = SseServerTransport("/messages/")
+
+port = int(os.getenv("MCP_SERVER_PORT", "8000"))
+
+# 传输方式：sse(/sse和/messages/)、streamable-http(单一的/mcp/端点)或stdio，可通过--transport指定
+transports = ("sse", "streamable-http", "stdio")
+server_transport = os.getenv("MCP_SERVER_TRANSPORT", "sse")
+if server_transport not in transports:
+    raise ValueError(f"Unknown MCP_SERVER_TRANSPORT '{server_transport}', available: {', '.join(transports)}")
+# streamable-http模式下的会话管理器，由create_starlette_app创建
+streamable_http = None
+
+# 多进程模式：MCP_SERVER_WORKERS大于1时启动多个工作进程共同监听端口，
+# 每个工作进程另外监听MCP_SERVER_WORKER_DIR中的Unix socket，用于转发不属于自己的会话消息
+server_workers = int(os.getenv("MCP_SERVER_WORKERS", "1"))
+server_worker_dir = os.getenv("MCP_SERVER_WORKER_DIR") or os.path.join(tempfile.gettempdir(), f"mcp-server-{port}")
+# streamable-http模式下工具调用直接以JSON返回，不为每个请求打开SSE流；
+# 多进程模式下默认使用无状态会话，请求可以由任意工作进程处理，不需要转发
+streamable_http_json_response = os.getenv("MCP_SERVER_JSON_RESPONSE", "1") == "1"
+streamable_http_stateless = os.getenv("MCP_SERVER_STATELESS", "1" if server_workers > 1 else "0") == "1"
+# 当前工作进程的编号，单进程模式下为None
+worker_id = None
+peer_clients = {}
+
+# fetch工具共享的HTTP连接池配置，可通过环境变量调整
+# 需要代理时通过FETCH_PROXY指定，不再对所有请求强制使用代理
+fetch_proxy = os.getenv("FETCH_PROXY") or None
+fetch_http2 = os.getenv("FETCH_HTTP2", "1") == "1"
+fetch_max_connections = int(os.getenv("FETCH_MAX_CONNECTIONS", "100"))
+fetch_max_keepalive_connections = int(os.getenv("FETCH_MAX_KEEPALIVE_CONNECTIONS", "20"))
+fetch_max_connections_per_host = int(os.getenv("FETCH_MAX_CONNECTIONS_PER_HOST", "6"))
+fetch_keepalive_expiry = float(os.getenv("FETCH_KEEPALIVE_EXPIRY", "60"))
+fetch_timeout = float(os.getenv("FETCH_TIMEOUT", "30"))
+
+# fetch工具的响应缓存配置，FETCH_CACHE_DIR非空时同时启用磁盘缓存
+fetch_cache_enabled = os.getenv("FETCH_CACHE", "1") == "1"
+fetch_cache_max_entries = int(os.getenv("FETCH_CACHE_MAX_ENTRIES", "1000"))
+fetch_cache_max_bytes = int(os.getenv("FETCH_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+fetch_cache_ttl = float(os.getenv("FETCH_CACHE_TTL", "300"))
+fetch_cache_max_age = float(os.getenv("FETCH_CACHE_MAX_AGE", "86400"))
+fetch_cache_dir = os.getenv("FETCH_CACHE_DIR") or None
+fetch_cache_max_disk_bytes = int(os.getenv("FETCH_CACHE_MAX_DISK_BYTES", str(1024 * 1024 * 1024)))
+
+# 下载限制：只接受HTML类型的内容，限制正文大小和下载总时间
+fetch_allowed_content_types = {
+    item.strip().lower()
+    for item in os.getenv("FETCH_ALLOWED_CONTENT_TYPES", "text/html,application/xhtml+xml").split(",")
+    if item.strip()
+}
+fetch_max_bytes = int(os.getenv("FETCH_MAX_BYTES", str(10 * 1024 * 1024)))
+fetch_max_time = float(os.getenv("FETCH_MAX_TIME", "30"))
+
+# fetch工具单次返回的字符数（默认值和上限），以及分页时保留最近文档的数量和时间
+fetch_default_max_length = int(os.getenv("FETCH_DEFAULT_MAX_LENGTH", "5000"))
+fetch_max_length = int(os.getenv("FETCH_MAX_LENGTH", "100000"))
+fetch_document_store_size = int(os.getenv("FETCH_DOCUMENT_STORE_SIZE", "100"))
+fetch_document_store_ttl = float(os.getenv("FETCH_DOCUMENT_STORE_TTL", "1800"))
+
+# fetch_many工具的并发限制：单次调用的URL数量、总并发数和同一主机的并发数
+fetch_many_max_urls = int(os.getenv("FETCH_MANY_MAX_URLS", "20"))
+fetch_many_concurrency = int(os.getenv("FETCH_MANY_CONCURRENCY", "8"))
+fetch_many_per_host = int(os.getenv("FETCH_MANY_PER_HOST", "2"))
+
+# 正文提取在独立的进程池中执行，避免阻塞事件循环；进程池不可用时退回线程池
+fetch_extract_executor = os.getenv("FETCH_EXTRACT_EXECUTOR", "process")
+# 工作进程数不少于4个，使大页面占用工作进程时其他请求仍有空闲的工作进程可用；
+# 多进程模式下各服务器进程分摊CPU核数，避免提取进程总数远超核数
+fetch_extract_workers = int(os.getenv("FETCH_EXTRACT_WORKERS", str(
+    max(4, os.cpu_count() or 1) if server_workers <= 1 else max(2, (os.cpu_count() or 1) // server_workers))))
+fetch_extract_timeout = float(os.getenv("FETCH_EXTRACT_TIMEOUT", "20"))
+# 默认的正文提取引擎（readability或lxml），fetch工具的extractor参数可按请求指定
+fetch_extractor = os.getenv("FETCH_EXTRACTOR", "readability")
+if fetch_extractor not in extractors:
+    raise ValueError(f"Unknown FETCH_EXTRACTOR '{fetch_extractor}', available: {', '.join(extractors)}")
+
+# 工具调用的准入控制：同时执行的调用数上限、等待队列长度和排队超时（秒），超出时立即返回过载错误
+admission = AdmissionController(
+    max_in_flight=int(os.getenv("MCP_SERVER_MAX_IN_FLIGHT", "32")),
+    max_queue=int(os.getenv("MCP_SERVER_MAX_QUEUE", "128")),
+    queue_timeout=float(os.getenv("MCP_SERVER_QUEUE_TIMEOUT", "10")),
+)
+
+http_client = None
+extract_executor = None
+# 提取任务在取得空闲的工作进程名额后才提交，FETCH_EXTRACT_TIMEOUT从任务开始执行时计算，不包括排队时间
+extract_slots = asyncio.Semaphore(fetch_extract_workers)
+host_semaphores = {}
+recent_documents = OrderedDict()
+fetch_cache = FetchCache(
+    max_entries=fetch_cache_max_entries,
+    max_bytes=fetch_cache_max_bytes,
+    default_ttl=fetch_cache_ttl,
+    max_age=fetch_cache_max_age,
+    cache_dir=fetch_cache_dir,
+    max_disk_bytes=fetch_cache_max_disk_bytes,
+) if fetch_cache_enabled else None
+
+# 运行指标，通过GET /metrics以Prometheus文本格式输出
+metrics = MetricsRegistry()
+active_sse_sessions = metrics.gauge("mcp_active_sse_sessions", "Number of open SSE sessions")
+messages_total = metrics.counter("mcp_messages_total", "Number of MCP messages posted by clients")
+http_requests_total = metrics.counter(
+    "mcp_streamable_http_requests_total", "Number of requests to the streamable HTTP endpoint", ("method",))
+tool_calls_total = metrics.counter("mcp_tool_calls_total", "Number of tool calls", ("tool", "status"))
+tool_calls_in_flight = metrics.gauge("mcp_tool_calls_in_flight", "Number of tool calls being executed")
+tool_call_duration = metrics.histogram("mcp_tool_call_duration_seconds", "Duration of tool calls", ("tool",))
+fetch_stage_duration = metrics.histogram(
+    "fetch_stage_duration_seconds",
+    "Duration of each stage of a fetch: host_wait, network, then the extractor stages "
+    "(readability and html2text, or parse and markdown for lxml)", ("stage",))
+fetch_results_total = metrics.counter(
+    "fetch_results_total", "Number of pages fetched by how they were served: hit, revalidated, miss, error", ("result",))
+fetch_bytes_total = metrics.counter("fetch_downloaded_bytes_total", "Bytes of page content downloaded")
+fetch_downloads_in_flight = metrics.gauge("fetch_downloads_in_flight", "Number of pages being downloaded")
+fetch_extractions_in_flight = metrics.gauge(
+    "fetch_extractions_in_flight", "Number of pages being extracted or waiting for an extract worker")
+metrics.gauge("fetch_extract_workers", "Size of the extract worker pool", function=lambda: fetch_extract_workers)
+metrics.gauge("fetch_documents_stored", "Number of documents kept for pagination",
+              function=lambda: len(recent_documents))
+metrics.gauge("fetch_cache_entries", "Number of entries in the fetch cache",
+              function=lambda: fetch_cache.stats()["entries"] if fetch_cache else 0)
+metrics.gauge("fetch_cache_bytes", "Size of the fetch cache in bytes",
+              function=lambda: fetch_cache.stats()["bytes"] if fetch_cache else 0)
+metrics.gauge("mcp_admission_max_in_flight", "Maximum number of tool calls executed at once",
+              function=lambda: admission.max_in_flight)
+metrics.gauge("mcp_admission_max_queue", "Maximum number of tool calls waiting for a slot",
+              function=lambda: admission.max_queue)
+metrics.gauge("mcp_admission_queued", "Number of tool calls waiting for a slot", function=lambda: admission.queued)
+metrics.gauge("mcp_admission_clients_waiting", "Number of clients with tool calls waiting for a slot",
+              function=lambda: admission.clients_waiting)
+metrics.gauge("mcp_admission_slots_in_use", "Number of admission slots held by running tool calls",
+              function=lambda: admission.in_flight)
+admission_wait = metrics.histogram("mcp_admission_wait_seconds", "Time tool calls waited for a slot", ("tool",))
+admission_weight = metrics.histogram(
+    "mcp_admission_slots_per_call", "Number of admission slots taken by one tool call", ("tool",),
+    buckets=(1, 2, 4, 8, 16, 32, 64))
+admission_rejected_total = metrics.counter(
+    "mcp_admission_rejected_total", "Number of tool calls rejected because the server was overloaded",
+    ("tool", "reason"))
+
+def create_http_client():
+    """
+    创建fetch工具共享的HTTP客户端，复用连接、TLS会话和keep-alive。
+    """
+    http2 = fetch_http2
+    if http2:
+        try:
+            import h2  # noqa: F401
+        except ImportError:
+            print("h2 is not installed, falling back to HTTP/1.1")
+            http2 = False
+
+    headers = {
+        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
+    }
+    limits = httpx.Limits(
+        max_connections=fetch_max_connections,
+        max_keepalive_connections=fetch_max_keepalive_connections,
+        keepalive_expiry=fetch_keepalive_expiry,
+    )
+    return httpx.AsyncClient(
+        follow_redirects=True,
+        headers=headers,
+        http2=http2,
+        limits=limits,
+        proxy=fetch_proxy,
+        timeout=fetch_timeout,
+    )
+
+@asynccontextmanager
+async def host_semaphore(url):
+    """
+    占用url所在主机的一个并发连接名额。
+
+    host_semaphores中每个主机记录[信号量, 持有和等待的请求数]，请求数归零时删除，长期运行时不会随主机数增长。
+    """
+    host = urlsplit(url).netloc.lower()
+    entry = host_semaphores.get(host)
+    if entry is None:
+        entry = host_semaphores[host] = [asyncio.Semaphore(fetch_max_connections_per_host), 0]
+    entry[1] += 1
+    try:
+        async with entry[0]:
+            yield
+    finally:
+        entry[1] -= 1
+        if entry[1] == 0:
+            del host_semaphores[host]
 
-port = 8000
+async def handle_cache_stats(request):
+    return JSONResponse(fetch_cache.stats() if fetch_cache else {})
+
+async def handle_admission_stats(request):
+    return JSONResponse(admission.stats())
+
+async def handle_metrics(request):
+    return Response(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+def extract_mp_context():
+    """
+    工作进程的启动方式：服务器进程中有多个线程，不直接fork，使用forkserver（不支持时使用spawn）。
+    """
+    method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+    return multiprocessing.get_context(method)
+
+def create_extract_executor(kind=None):
+    """
+    创建正文提取使用的进程池，无法创建时退回线程池。
+    """
+    kind = kind or fetch_extract_executor
+    if kind == "process":
+        try:
+            executor = ProcessPoolExecutor(max_workers=fetch_extract_workers, mp_context=extract_mp_context())
+            # 提前启动一个任务以确认子进程可以正常创建
+            executor.submit(int).result(timeout=30)
+            return executor
+        except Exception as err:
+            print(f"Process pool unavailable ({err}), falling back to thread pool")
+    return ThreadPoolExecutor(max_workers=fetch_extract_workers, thread_name_prefix="extract")
+
+def get_extract_executor():
+    global extract_executor
+    if extract_executor is None:
+        extract_executor = create_extract_executor()
+    return extract_executor
+
+def recycle_extract_executor(executor):
+    """
+    以新的进程池替换executor，并终止其中的工作进程，释放被超时任务占用的进程。
+
+    旧进程池中进行中的其他任务会因进程被终止而失败，由run_extraction在新的进程池中重试。
+    """
+    global extract_executor
+    if extract_executor is not executor:
+        return
+    # 进程池已确认可用，不再像create_extract_executor那样同步等待子进程启动
+    extract_executor = ProcessPoolExecutor(max_workers=fetch_extract_workers, mp_context=extract_mp_context())
+    # ProcessPoolExecutor没有公开终止工作进程的接口
+    for process in list((executor._processes or {}).values()):
+        process.terminate()
+    executor.shutdown(wait=False, cancel_futures=True)
+
+def shutdown_extract_executor():
+    global extract_executor
+    if extract_executor is not None:
+        # 等待工作进程退出，避免服务器进程先退出后遗留孤儿进程；进行中的提取受FETCH_EXTRACT_TIMEOUT限制
+        extract_executor.shutdown(wait=True, cancel_futures=True)
+        extract_executor = None
+
+@asynccontextmanager
+async def lifespan(starlette_app):
+    global http_client
+    http_client = create_http_client()
+    get_extract_executor()
+    try:
+        async with AsyncExitStack() as stack:
+            if streamable_http is not None:
+                await stack.enter_async_context(streamable_http.run())
+            yield
+    finally:
+        await http_client.aclose()
+        http_client = None
+        for client in peer_clients.values():
+            await client.aclose()
+        peer_clients.clear()
+        shutdown_extract_executor()
+        if fetch_cache:
+            await asyncio.to_thread(fetch_cache.close)
 
 async def handle_sse(request):
     print("Handling sse")
-    async with sse.connect_sse(
-            request.scope, request.receive, request._send
-    ) as streams:
-        await app.run(
-            streams[0], streams[1], app.create_initialization_options()
-        )
-
-async def handle_messages(request):
-    print(f"Handling messages with {request.scope}, {request.receive}, {request._send}")
+    active_sse_sessions.inc()
+    try:
+        async with sse.connect_sse(
+                request.scope, request.receive, request._send
+        ) as streams:
+            await app.run(
+                streams[0], streams[1], app.create_initialization_options()
+            )
+    finally:
+        active_sse_sessions.dec()
+    return Response()
+
+async def handle_messages(scope, receive, send):
+    print(f"Handling messages with {scope}, {receive}, {send}")
+    messages_total.inc()
+    # 多进程模式下消息地址为/messages/<工作进程编号>/，会话不属于当前进程时转发给持有会话的进程
+    match = re.search(r"/(\d+)/?$", scope["path"])
+    owner = int(match.group(1)) if match else None
+    if owner is not None and owner != worker_id:
+        await forward_message(owner, scope, receive, send)
+        return
     # 1. 处理消息
-    await sse.handle_post_message(request.scope, request.receive, request._send)
+    # 以ASGI应用方式挂载，响应由transport直接发送，保证客户端的长连接不会被断开
+    await sse.handle_post_message(scope, receive, send)
+
+async def handle_streamable_http(scope, receive, send):
+    # 同一个端点处理POST的消息、GET的服务器通知流和DELETE的会话结束请求
+    http_requests_total.inc(scope["method"])
+    if scope["method"] == "POST":
+        messages_total.inc()
+    await streamable_http.handle_request(scope, receive, send)
+
+def worker_socket_path(index):
+    return os.path.join(server_worker_dir, f"worker-{index}.sock")
+
+async def forward_message(owner, scope, receive, send):
+    """
+    通过Unix socket将消息转发给持有会话的工作进程，并将其响应原样返回。
+    """
+    body = []
+    while True:
+        message = await receive()
+        body.append(message.get("body", b""))
+        if not message.get("more_body"):
+            break
+
+    client = peer_clients.get(owner)
+    if client is None:
+        client = peer_clients[owner] = httpx.AsyncClient(
+            transport=httpx.AsyncHTTPTransport(uds=worker_socket_path(owner)), timeout=fetch_timeout)
+    headers = {key.decode("latin-1"): value.decode("latin-1")
+               for key, value in scope["headers"] if key.lower() == b"content-type"}
+    url = f"http://worker-{owner}/messages/{owner}/?{scope['query_string'].decode('latin-1')}"
+    try:
+        response = await client.post(url, content=b"".join(body), headers=headers)
+        reply = Response(response.content, status_code=response.status_code,
+                         media_type=response.headers.get("content-type"))
+    except httpx.HTTPError as err:
+        reply = Response(f"Worker {owner} unavailable: {err}", status_code=502)
+    await reply(scope, receive, send)
+
+async def run_extraction(url, html, engine):
+    """
+    在工作池中执行正文提取，开始执行后超过FETCH_EXTRACT_TIMEOUT时报错，并回收执行超时任务的工作进程。
+
+    跨进程只传递下载时已解码的HTML文本和提取出的Markdown。
+    """
+    global extract_executor
+    loop = asyncio.get_running_loop()
+    for attempt in range(2):
+        fetch_extractions_in_flight.inc()
+        try:
+            async with extract_slots:
+                executor = get_extract_executor()
+                start_time = time.time()
+                try:
+                    markdown, timings = await asyncio.wait_for(
+                        loop.run_in_executor(executor, extract_markdown, html, engine),
+                        fetch_extract_timeout)
+                except asyncio.TimeoutError:
+                    # 线程无法终止，只有进程池可以回收
+                    if isinstance(executor, ProcessPoolExecutor):
+                        print(f"Extracting {url} timed out, recycling the extract worker pool")
+                        recycle_extract_executor(executor)
+                    raise TimeoutError(f"Extracting content of {url} exceeded {fetch_extract_timeout} seconds")
+            for stage, elapsed in timings.items():
+                fetch_stage_duration.observe(elapsed, stage)
+            print(f"Extracted {url} in {time.time() - start_time:.3f} seconds")
+            return markdown
+        except BrokenExecutor as err:
+            # 工作池因超时被回收或工作进程异常退出（如内存不足被终止）时，在新的进程池中重试；
+            # 只有无法再创建进程池时才退回线程池
+            if extract_executor is executor:
+                print(f"Extract executor broken ({err}), starting a new worker pool")
+                executor.shutdown(wait=False, cancel_futures=True)
+                extract_executor = create_extract_executor()
+            if attempt:
+                raise
+        finally:
+            fetch_extractions_in_flight.dec()
+
+def sniff_charset(head):
+    """
+    从文档开头的<meta>标签中识别字符集。
+    """
+    match = re.search(rb"""<meta[^>]+charset=["']?([A-Za-z0-9_.:-]+)""", head, re.IGNORECASE)
+    if match:
+        charset = match.group(1).decode("ascii")
+        try:
+            codecs.lookup(charset)
+            return charset
+        except LookupError:
+            pass
+    return None
+
+def check_content_type(url, content_type):
+    media_type = content_type.split(";")[0].strip().lower()
+    # 未声明Content-Type时按HTML处理
+    if media_type and media_type not in fetch_allowed_content_types:
+        raise ValueError(f"Unsupported content type '{media_type}' for {url}")
+
+async def download_html(url, headers=None):
+    """
+    流式下载网页并增量解码。
+
+    非HTML的Content-Type在读取正文前即被拒绝；正文超过FETCH_MAX_BYTES时立即中止，
+    整个下载受FETCH_MAX_TIME限制。
+
+    返回：
+        tuple: (response, html)，304响应时html为None
+    """
+    async with http_client.stream("GET", url, headers=headers) as response:
+        if response.status_code == 304:
+            return response, None
+        response.raise_for_status()
+        check_content_type(url, response.headers.get("content-type", ""))
+
+        content_length = response.headers.get("content-length")
+        if content_length and content_length.isdigit() and int(content_length) > fetch_max_bytes:
+            raise ValueError(f"Content of {url} is too large ({content_length} bytes, limit {fetch_max_bytes})")
+
+        decoder = None
+        parts = []
+        size = 0
+        try:
+            async for chunk in response.aiter_bytes():
+                size += len(chunk)
+                if size > fetch_max_bytes:
+                    raise ValueError(f"Content of {url} exceeds {fetch_max_bytes} bytes")
+                if decoder is None:
+                    # 优先使用响应头声明的字符集，其次是文档<meta>中声明的字符集
+                    charset = response.charset_encoding or sniff_charset(chunk[:4096]) or "utf-8"
+                    decoder = codecs.getincrementaldecoder(charset)(errors="replace")
+                parts.append(decoder.decode(chunk))
+        finally:
+            fetch_bytes_total.inc(amount=size)
+        if decoder is not None:
+            parts.append(decoder.decode(b"", final=True))
+        return response, "".join(parts)
+
+def document_key(url, engine):
+    """
+    缓存和分页使用的文档键，默认引擎以外的提取结果单独保存。
+    """
+    return url if engine == fetch_extractor else f"{engine} {url}"
+
+async def fetch_markdown(url, engine=None):
+    """
+    获取网页并返回使用engine提取的Markdown，优先使用缓存。
+    """
+    engine = engine or fetch_extractor
+    key = document_key(url, engine)
+    entry = await fetch_cache.get(key) if fetch_cache else None
+    if entry and entry.fresh:
+        fetch_results_total.inc("hit")
+        return entry.markdown
+
+    headers = entry.conditional_headers() if entry else None
+    wait_start = time.perf_counter()
+    async with host_semaphore(url):
+        network_start = time.perf_counter()
+        fetch_stage_duration.observe(network_start - wait_start, "host_wait")
+        fetch_downloads_in_flight.inc()
+        try:
+            response, html = await asyncio.wait_for(download_html(url, headers), fetch_max_time)
+        except asyncio.TimeoutError:
+            fetch_results_total.inc("error")
+            raise TimeoutError(f"Downloading {url} exceeded {fetch_max_time} seconds")
+        except Exception:
+            fetch_results_total.inc("error")
+            raise
+        finally:
+            fetch_downloads_in_flight.dec()
+            fetch_stage_duration.observe(time.perf_counter() - network_start, "network")
+
+    if entry and response.status_code == 304:
+        # 内容未变化，直接使用缓存的Markdown，无需重新提取
+        fetch_results_total.inc("revalidated")
+        fetch_cache.refresh(entry, response.headers)
+        return entry.markdown
+    try:
+        markdown = await run_extraction(url, html, engine)
+    except Exception:
+        fetch_results_total.inc("error")
+        raise
+    fetch_results_total.inc("miss")
+    if fetch_cache:
+        fetch_cache.put(key, html, markdown, response.headers)
+    return markdown
+
+def remember_document(url, markdown):
+    """
+    记录最近获取的文档，分页请求后续内容时直接使用，不受响应缓存策略影响。
+    """
+    recent_documents.pop(url, None)
+    recent_documents[url] = (markdown, time.time())
+    while len(recent_documents) > fetch_document_store_size:
+        recent_documents.popitem(last=False)
+
+def recall_document(url):
+    item = recent_documents.get(url)
+    if item is None or time.time() - item[1] > fetch_document_store_ttl:
+        return None
+    recent_documents.move_to_end(url)
+    return item[0]
 
 async def fetch_website(
         url: str,
+        start_index: int = 0,
+        max_length: int = None,
+        engine: str = None,
 ) -> list[types.TextContent | types.ImageContent | types.EmbeddedResource]:
-    headers = {
-        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
-    }
-    async with httpx.AsyncClient(follow_redirects=True, headers=headers) as client:
-        response = await client.get(url)
-        response.raise_for_status()
+    """
+    获取网页内容中从start_index开始、最多max_length个字符的部分，并注明文档总长度。
+    """
+    max_length = max_length or fetch_default_max_length
+    key = document_key(url, engine or fetch_extractor)
+    markdown = recall_document(key) if start_index > 0 else None
+    if markdown is None:
+        markdown = await fetch_markdown(url, engine)
+    remember_document(key, markdown)
+
+    total_length = len(markdown)
+    if start_index >= total_length and total_length > 0:
+        return [types.TextContent(
+            type="text",
+            text=f"No more content: start_index {start_index} is beyond the end of the document "
+                 f"({total_length} characters).")]
 
-        # 2. 提取正文
-        doc = Document(response.text)
-        clean_html = doc.summary()  # 获取清理后的正文HTML
+    end_index = min(start_index + max_length, total_length)
+    text = markdown[start_index:end_index]
+    if end_index < total_length:
+        text += (f"\n\n[Showing characters {start_index}-{end_index} of {total_length}. "
+                 f"Call fetch with start_index={end_index} to get more content.]")
+    elif start_index > 0:
+        text += f"\n\n[Showing characters {start_index}-{end_index} of {total_length}, end of document.]"
+    return [types.TextContent(type="text", text=text)]
+
+async def fetch_many_websites(
+        urls: list[str],
+        engine: str = None,
+) -> list[types.TextContent | types.ImageContent | types.EmbeddedResource]:
+    """
+    并发获取多个网页，每个URL返回一个TextContent，单个URL失败时返回错误信息而不影响其他URL。
+    """
+    urls = list(dict.fromkeys(urls))
+    if len(urls) > fetch_many_max_urls:
+        raise ValueError(f"Too many urls ({len(urls)}), at most {fetch_many_max_urls} are allowed")
 
-        # 3. 转换为Markdown
-        h = html2text.HTML2Text()
-        h.single_line_break = True   # 单换行转为<br>
-        h.wrap_links = False        # 不换行长链接
-        h.mark_code = True          # 高亮代码块
-        h.ignore_links = False      # 保留链接
-        h.ignore_images = False     # 保留图片
+    total_semaphore = asyncio.Semaphore(fetch_many_concurrency)
+    per_host_semaphores = {}
 
-        markdown = h.handle(clean_html)
-        # 移除多余空行
-        markdown = "\n".join([line for line in markdown.split("\n") if line.strip()])
+    async def fetch_one(url):
+        host = urlsplit(url).netloc.lower()
+        if host not in per_host_semaphores:
+            per_host_semaphores[host] = asyncio.Semaphore(fetch_many_per_host)
+        # 先取得主机的名额再占用总名额，等待同一主机的URL不会占住其他主机可以使用的总名额
+        async with per_host_semaphores[host], total_semaphore:
+            try:
+                contents = await fetch_website(url, engine=engine)
+                text = contents[0].text
+            except Exception as err:
+                text = f"Error: {err}"
+        return types.TextContent(type="text", text=f"URL: {url}\n{text}")
 
-        return [types.TextContent(type="text", text=markdown)]
+    return list(await asyncio.gather(*(fetch_one(url) for url in urls)))
 
 @app.call_tool()
 async def call_tool(
   name: str, arguments: dict
 ) -> list[types.TextContent | types.ImageContent | types.EmbeddedResource]:
+    # 未知的工具名统一记为unknown，避免标签值无限增长
+    tool = name if name in ("fetch", "fetch_many") else "unknown"
+    # 以客户端的MCP会话区分客户端，排队时在各客户端之间轮流分配执行名额
+    try:
+        client = app.request_context.session
+    except LookupError:
+        client = None
+    weight = admission.weight_of(tool_weight(name, arguments))
+    try:
+        async with admission.slot(client, weight) as wait_time:
+            admission_wait.observe(wait_time, tool)
+            admission_weight.observe(weight, tool)
+            start_time = time.perf_counter()
+            status = "error"
+            tool_calls_in_flight.inc()
+            try:
+                result = await execute_tool(name, arguments)
+                status = "ok"
+                return result
+            finally:
+                tool_calls_in_flight.dec()
+                tool_calls_total.inc(tool, status)
+                tool_call_duration.observe(time.perf_counter() - start_time, tool)
+    except Overloaded as err:
+        admission_rejected_total.inc(tool, err.reason)
+        tool_calls_total.inc(tool, "rejected")
+        print(f"Rejected {name} call: {err}")
+        raise
+
+def tool_weight(name, arguments):
+    """
+    返回工具调用占用的准入名额数：fetch_many按同时进行的下载和提取数计算，其他调用为1。
+    """
+    if name == "fetch_many" and isinstance(arguments.get("urls"), list):
+        return min(len(arguments["urls"]), fetch_many_concurrency)
+    return 1
+
+async def execute_tool(name, arguments):
+    engine = arguments.get("extractor") or None
+    if engine is not None and engine not in extractors:
+        raise ValueError(f"Unknown extractor '{engine}', available: {', '.join(extractors)}")
     if name == "fetch":
         if "url" not in arguments:
             raise ValueError("Missing required argument 'url'")
-        return await fetch_website(arguments["url"])
+        start_index = int(arguments.get("start_index") or 0)
+        max_length = int(arguments.get("max_length") or fetch_default_max_length)
+        if start_index < 0 or max_length <= 0:
+            raise ValueError("'start_index' must be >= 0 and 'max_length' must be > 0")
+        return await fetch_website(arguments["url"], start_index, min(max_length, fetch_max_length), engine)
+    elif name == "fetch_many":
+        if not isinstance(arguments.get("urls"), list) or not arguments["urls"]:
+            raise ValueError("Missing required argument 'urls'")
+        return await fetch_many_websites(arguments["urls"], engine)
     else:
         raise ValueError(f"Unknown tool '{name}'")
 
+def extractor_schema():
+    return {
+        "type": "string",
+        "enum": list(extractors),
+        "default": fetch_extractor,
+        "description": "Content extraction engine: readability removes boilerplate more thoroughly, "
+                       "lxml is much faster on large pages",
+    }
+
 @app.list_tools()
 async def list_tools() -> list[types.Tool]:
     print("Listing tools")
     return [
         types.Tool(
             name="fetch",
-            description="Fetches a website and returns its content",
+            description="Fetches a website and returns its content as markdown. Long pages are returned "
+                        "in parts, use start_index to read the following parts",
             inputSchema={
                 "type": "object",
                 "required": ["url"],
@@ -91,21 +680,159 @@ async def list_tools() -> list[types.Tool]:
                     "url": {
                         "type": "string",
                         "description": "URL to fetch",
-                    }
+                    },
+                    "start_index": {
+                        "type": "integer",
+                        "minimum": 0,
+                        "default": 0,
+                        "description": "Character offset to start from, used to read the next part of a long page",
+                    },
+                    "max_length": {
+                        "type": "integer",
+                        "minimum": 1,
+                        "maximum": fetch_max_length,
+                        "default": fetch_default_max_length,
+                        "description": "Maximum number of characters to return",
+                    },
+                    "extractor": extractor_schema(),
                 },
             },
-        )
+        ),
+        types.Tool(
+            name="fetch_many",
+            description="Fetches several websites concurrently and returns the content of each, "
+                        "or an error for the ones that failed",
+            inputSchema={
+                "type": "object",
+                "required": ["urls"],
+                "properties": {
+                    "urls": {
+                        "type": "array",
+                        "items": {"type": "string"},
+                        "maxItems": fetch_many_max_urls,
+                        "description": "URLs to fetch",
+                    },
+                    "extractor": extractor_schema(),
+                },
+            },
+        ),
     ]
 
-starlette_app = Starlette(
-    debug=True,
-    routes=[
-        Route("/sse", endpoint=handle_sse, methods=["GET"]),
-        Route("/messages", endpoint=handle_messages, methods=["POST"]),
-    ],
-)
+def create_starlette_app(transport):
+    """
+    创建HTTP服务器应用，按传输方式挂载MCP端点，两种方式共用同一组call_tool/list_tools处理函数。
+    """
+    global streamable_http
+    if transport == "streamable-http":
+        streamable_http = StreamableHTTPSessionManager(
+            app=app, json_response=streamable_http_json_response, stateless=streamable_http_stateless)
+        routes = [Mount("/mcp", app=handle_streamable_http)]
+    else:
+        streamable_http = None
+        routes = [
+            Route("/sse", endpoint=handle_sse, methods=["GET"]),
+            Mount("/messages/", app=handle_messages),
+        ]
+    return Starlette(
+        debug=True,
+        routes=routes + [
+            Route("/cache", endpoint=handle_cache_stats, methods=["GET"]),
+            Route("/admission", endpoint=handle_admission_stats, methods=["GET"]),
+            Route("/metrics", endpoint=handle_metrics, methods=["GET"]),
+        ],
+        lifespan=lifespan,
+    )
+
+starlette_app = create_starlette_app(server_transport)
+
+async def run_stdio():
+    """
+    以stdio方式运行服务器，由客户端作为子进程启动。
+
+    stdout只用于传输协议消息，服务器的日志输出改为写到stderr。
+    """
+    stdout = anyio.wrap_file(TextIOWrapper(sys.stdout.buffer, encoding="utf-8"))
+    sys.stdout = sys.stderr
+    async with lifespan(None):
+        async with stdio_server(stdout=stdout) as streams:
+            await app.run(streams[0], streams[1], app.create_initialization_options())
 
-# 使用uvicorn运行服务器
+def run_worker(index, shared_socket, transport):
+    """
+    工作进程入口：同时监听共享的服务端口和自己的Unix socket。
+    """
+    global sse, worker_id, starlette_app
+    worker_id = index
+    starlette_app = create_starlette_app(transport)
+    # 消息地址中带有工作进程编号，其他工作进程收到该会话的消息时据此转发
+    sse = SseServerTransport(f"/messages/{index}/")
+
+    path = worker_socket_path(index)
+    if os.path.exists(path):
+        os.remove(path)
+    private_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    private_socket.bind(path)
+    os.chmod(path, 0o600)
+
+    config = uvicorn.Config(starlette_app, host="0.0.0.0", port=port)
+    uvicorn.Server(config).run(sockets=[shared_socket, private_socket])
+
+def run_workers(count, transport):
+    """
+    以count个工作进程运行服务器，工作进程异常退出时自动重启。
+
+    SSE连接由接受连接的工作进程持有，客户端随后的消息可能到达任意工作进程，
+    由handle_messages根据消息地址中的编号转发。
+    """
+    os.makedirs(server_worker_dir, exist_ok=True)
+    shared_socket = uvicorn.Config(starlette_app, host="0.0.0.0", port=port).bind_socket()
+    spawn = multiprocessing.get_context("spawn")
+    processes = {}
+    stopping = False
+
+    def start(index):
+        process = spawn.Process(target=run_worker, args=(index, shared_socket, transport), name=f"mcp-worker-{index}")
+        process.start()
+        processes[index] = process
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+    for index in range(count):
+        start(index)
+    print(f"Started {count} workers on port {port}")
+    try:
+        while not stopping:
+            time.sleep(0.5)
+            for index, process in list(processes.items()):
+                if not process.is_alive() and not stopping:
+                    print(f"Worker {index} exited with code {process.exitcode}, restarting")
+                    start(index)
+    finally:
+        for process in processes.values():
+            process.terminate()
+        for process in processes.values():
+            process.join(10)
+        shared_socket.close()
+
+# 使用uvicorn运行服务器，stdio模式下直接通过标准输入输出通信
 if __name__ == "__main__":
-    import uvicorn
-    uvicorn.run(starlette_app, host="0.0.0.0", port=port)
+    parser = argparse.ArgumentParser(description='MCP fetch服务器')
+    parser.add_argument('--transport', type=str, choices=transports, default=server_transport,
+                        help='传输方式：sse、streamable-http(单一的/mcp/端点)或stdio(由客户端作为子进程启动)')
+    args = parser.parse_args()
+    # 有状态的streamable-http会话只存在于创建它的工作进程中，/mcp/请求不像SSE消息那样按会话转发
+    if args.transport == "streamable-http" and server_workers > 1 and not streamable_http_stateless:
+        parser.error("stateful streamable-http sessions cannot be shared between workers, "
+                     "set MCP_SERVER_STATELESS=1 or MCP_SERVER_WORKERS=1")
+
+    if args.transport == "stdio":
+        asyncio.run(run_stdio())
+    elif server_workers > 1:
+        run_workers(server_workers, args.transport)
+    else:
+        starlette_app = create_starlette_app(args.transport)
+        uvicorn.run(starlette_app, host="0.0.0.0", port=port)